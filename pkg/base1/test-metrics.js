@@ -139,6 +139,45 @@ QUnit.test("non-instanced decompression", assert => {
     assert.deepEqual(sink.samples, [[10], [10]], "got correct samples");
 });
 
+QUnit.test("delta meta", assert => {
+    assert.expect(4);
+
+    const peer = new MockPeer();
+    const sink = new MockSink();
+
+    peer.addEventListener("open", function(event, channel, options) {
+        assert.strictEqual(options["delta-meta"], true, "asked for delta meta");
+    });
+
+    const metrics = cockpit.metrics(1000, {
+        source: "internal",
+        metrics: [{ name: "m1" }, { name: "m2" }],
+    });
+    metrics.series = sink.series;
+
+    metrics.follow();
+    peer.send_json({
+        timestamp: 0,
+        interval: 1000,
+        metrics: [{ name: "m1" }, { name: "m2", instances: ["a", "b", "c"] }]
+    });
+    peer.send_json([[1, [1, 2, 3]]]);
+    peer.send_json({
+        timestamp: 0,
+        interval: 1000,
+        delta: true,
+        metrics: [{ }, { removed: ["b"], added: ["d", "e"] }]
+    });
+
+    assert.deepEqual(metrics.meta.metrics, [{ name: "m1" }, { name: "m2", instances: ["a", "c", "d", "e"] }],
+                     "rebuilt the full meta");
+    assert.notOk("delta" in metrics.meta, "delta flag is gone");
+
+    peer.send_json([[2, [1, 3, 4, 5]]]);
+    assert.deepEqual(metrics.meta.mapping.m2, { "": 1, a: { "": 0 }, c: { "": 1 }, d: { "": 2 }, e: { "": 3 } },
+                     "mapping follows the new instances");
+});
+
 QUnit.test("interval validation", assert => {
     assert.expect(2);
     const done = assert.async();
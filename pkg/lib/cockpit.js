@@ -4367,11 +4367,16 @@ function factory() {
                 payload: "metrics1",
                 interval: interval,
                 source: "internal",
+                "delta-meta": true,
                 ...options_list[0]
             };
 
             delete options.archive_source;
 
+            const float64 = options["data-encoding"] == "float64";
+            if (float64)
+                options.binary = true;
+
             const channel = cockpit.channel(options);
             channels.push(channel);
 
@@ -4402,12 +4407,54 @@ function factory() {
                 }
             });
 
+            /* A point in time in "float64" encoding: a header and one value per slot */
+            function decode_float64(payload) {
+                const view = new DataView(payload.buffer, payload.byteOffset, payload.byteLength);
+                const count = view.getUint32(4, true);
+                /* copy, since the payload is not aligned for a Float64Array */
+                const values = new window.Float64Array(payload.slice(8, 8 + 8 * count).buffer);
+                const sample = [];
+                let pos = 0;
+                meta.metrics.forEach(function(metric) {
+                    if (metric.instances) {
+                        const len = metric.instances.length;
+                        sample.push(Array.from(values.subarray(pos, pos + len), value => isNaN(value) ? false : value));
+                        pos += len;
+                    } else {
+                        sample.push(isNaN(values[pos]) ? false : values[pos]);
+                        pos += 1;
+                    }
+                });
+                return [sample];
+            }
+
             channel.addEventListener("message", function(ev, payload) {
-                const message = JSON.parse(payload);
+                let message;
+                if (!float64)
+                    message = JSON.parse(payload);
+                else if (payload[0] == 123) /* '{' */
+                    message = JSON.parse(cockpit.utf8_decoder().decode(payload));
+                else if (meta)
+                    message = decode_float64(payload);
+                else
+                    return;
 
                 /* A meta message? */
                 const message_len = message.length;
                 if (message_len === undefined) {
+                    /* Only the changes to the instance lists? */
+                    if (message.delta && meta) {
+                        message.metrics = meta.metrics.map(function(metric, i) {
+                            const change = message.metrics[i];
+                            if (!metric.instances || !(change.removed || change.added))
+                                return metric;
+                            const removed = new Set(change.removed || []);
+                            const instances = metric.instances.filter(instance => !removed.has(instance));
+                            return { ...metric, instances: instances.concat(change.added || []) };
+                        });
+                        delete message.delta;
+                    }
+
                     meta = message;
                     let timestamp = 0;
                     if (meta.now && meta.timestamp)
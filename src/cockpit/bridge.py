@@ -21,25 +21,53 @@ import json
 import logging
 import pwd
 import os
-import shlex
+import re
 import socket
+import time
 
-from typing import Dict, Iterable, Tuple, Type
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple, Type
 
 from systemd_ctypes import EventLoopPolicy, bus
 
 from .channel import ChannelRoutingRule
-from .channels import CHANNEL_TYPES
-from .internal_endpoints import EXPORTS
+from .channels import load_channel_types
+from .internal_endpoints import EXPORTS, cockpit_Packages
 from .packages import Packages
 from .remote import HostRoutingRule
 from .router import Router
 from .superuser import SUPERUSER_AUTH_COOKIE, SuperuserRoutingRule
 from .transports import StdioTransport
 
+if TYPE_CHECKING:
+    import cProfile
+
 logger = logging.getLogger(__name__)
 
 
+def parse_os_release(text: str) -> Dict[str, str]:
+    """Parses the contents of an os-release(5) file
+
+    The format is a small subset of shell: one KEY=value assignment per line,
+    where the value may be in single or double quotes.  Like in the shell,
+    a backslash escapes any character in an unquoted value, but only one of
+    \\ " $ and ` in double quotes.  Single quotes don't have escapes.
+    """
+    result = {}
+    for line in text.splitlines():
+        key, eq, value = line.strip().partition('=')
+        if not eq or key.startswith('#'):
+            continue
+        quote = ''
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+            quote, value = value[0], value[1:-1]
+        if quote == '"':
+            value = re.sub(r'\\([\\"$`])', r'\1', value)
+        elif not quote:
+            value = re.sub(r'\\(.)', r'\1', value)
+        result[key] = value
+    return result
+
+
 class InternalBus:
     exportees: list[bus.Slot]
 
@@ -53,31 +81,107 @@ class InternalBus:
         self.exportees.append(self.server.add_object(path, obj))
 
 
+class StartupTrace(bus.Object, interface='cockpit.Startup'):
+    """Records how long each phase of startup takes, up to sending init
+
+    Timestamps are seconds on the monotonic clock since the process started,
+    so the first phase includes the interpreter startup and our imports.  The
+    result is logged, and exported on the internal bus as /startup.
+    """
+    phases = bus.Interface.Property('a{sd}', value={})
+
+    marks: List[Tuple[str, float]]
+    profile: 'Optional[cProfile.Profile]' = None
+    profile_filename: Optional[str] = None
+    finished = False
+
+    def __init__(self, profile_filename: Optional[str] = None):
+        self.start = time.monotonic() - self.process_age()
+        self.marks = []
+
+        if profile_filename is not None:
+            import cProfile  # only when asked for: it's not free to import
+            self.profile = cProfile.Profile()
+            self.profile_filename = profile_filename
+            self.profile.enable()
+
+    @staticmethod
+    def process_age() -> float:
+        # /proc/self/stat has our start time in clock ticks since boot
+        try:
+            with open('/proc/self/stat') as file:
+                # skip the command name: it may contain spaces
+                fields = file.read().rpartition(')')[2].split()
+        except OSError:
+            return 0.0
+        starttime = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        return max(time.clock_gettime(time.CLOCK_BOOTTIME) - starttime, 0.0)
+
+    def mark(self, phase: str) -> None:
+        if not self.finished:
+            self.marks.append((phase, time.monotonic() - self.start))
+
+    def finish(self) -> None:
+        if self.finished:
+            return
+
+        self.mark('init')
+        self.finished = True
+        self.phases = dict(self.marks)
+
+        previous = 0.0
+        steps = []
+        for phase, timestamp in self.marks:
+            steps.append(f'{phase} +{(timestamp - previous) * 1000:.1f}ms')
+            previous = timestamp
+        logger.debug('Startup took %.1fms: %s', previous * 1000, ', '.join(steps))
+
+        if self.profile is not None and self.profile_filename is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.profile_filename)
+            logger.debug('Wrote startup profile to %s', self.profile_filename)
+            self.profile = None
+
+
 class Bridge(Router):
-    def __init__(self, args: argparse.Namespace):
+    def __init__(self, args: argparse.Namespace, startup: Optional[StartupTrace] = None):
+        self.startup = startup if startup is not None else StartupTrace()
+        self.startup.mark('main')
+
         self.internal_bus = InternalBus(EXPORTS)
+        self.internal_bus.export('/startup', self.startup)
+        self.startup.mark('internal-bus')
+
         self.packages = Packages()
+        self.startup.mark('packages')
         self.args = args
 
+        self.packages_endpoint = cockpit_Packages(self.packages)
+        self.internal_bus.export('/packages', self.packages_endpoint)
+        # The privileged bridge doesn't serve packages
+        if not args.privileged:
+            self.packages.watch(self.packages_endpoint)
+
         self.superuser_rule = SuperuserRoutingRule(self, args.privileged)
         self.internal_bus.export('/superuser', self.superuser_rule)
+        self.startup.mark('superuser')
 
         super().__init__([
             HostRoutingRule(self),
             self.superuser_rule,
-            ChannelRoutingRule(self, CHANNEL_TYPES),
+            ChannelRoutingRule(self, load_channel_types),
         ])
+        self.startup.mark('routing')
 
     @staticmethod
-    def get_os_release():
+    def get_os_release() -> Dict[str, str]:
         try:
             file = open('/etc/os-release', encoding='utf-8')
         except FileNotFoundError:
             file = open('/usr/lib/os-release', encoding='utf-8')
 
         with file:
-            lexer = shlex.shlex(file, posix=True, punctuation_chars=True)
-            return dict(token.split('=', 1) for token in lexer)
+            return parse_os_release(file.read())
 
     def do_init(self, message: Dict[str, object]) -> None:
         superuser = message.get('superuser')
@@ -91,13 +195,22 @@ class Bridge(Router):
                 self.superuser_rule.answer(response)
 
     def do_send_init(self) -> None:
-        self.write_control(command='init', version=1,
-                           checksum=self.packages.checksum,
+        # The peer of a privileged bridge is the unprivileged bridge, which
+        # ignores the checksum.  Don't make the first privileged channel wait
+        # for us to hash all of the packages.  test/pytest/bench_startup.py
+        # measures the difference.
+        checksum = None if self.args.privileged else self.packages.checksum
+        self.startup.mark('checksum')
+        os_release = self.get_os_release()
+        self.startup.mark('os-release')
+
+        self.write_control(command='init', version=1, checksum=checksum,
                            packages={p: None for p in self.packages.packages},
-                           os_release=self.get_os_release(), capabilities={'explicit-superuser': True})
+                           os_release=os_release, capabilities={'explicit-superuser': True})
+        self.startup.finish()
 
 
-async def run(args) -> None:
+async def run(args, startup: Optional[StartupTrace] = None) -> None:
     logger.debug("Hi. How are you today?")
 
     # Unit tests require this
@@ -107,7 +220,7 @@ async def run(args) -> None:
     os.environ['USER'] = me.pw_name
 
     logger.debug('Starting the router.')
-    router = Bridge(args)
+    router = Bridge(args, startup)
     StdioTransport(asyncio.get_running_loop(), router)
 
     logger.debug('Startup done.  Looping until connection closes.')
@@ -127,6 +240,8 @@ def main() -> None:
     parser.add_argument('--rules', action='store_true', help='Show Cockpit bridge rules')
     parser.add_argument('--debug', action='store_true', help='Enable debug output (very verbose)')
     parser.add_argument('--version', action='store_true', help='Show Cockpit version information')
+    parser.add_argument('--startup-profile', metavar='FILE',
+                        help='Write a cProfile of startup, up to the init message, to FILE')
     args = parser.parse_args()
 
     if args.debug:
@@ -137,8 +252,9 @@ def main() -> None:
     elif args.bridges:
         print(json.dumps(Packages().get_bridges(), indent=2))
     else:
+        startup = StartupTrace(args.startup_profile)
         asyncio.set_event_loop_policy(EventLoopPolicy())
-        asyncio.run(run(args), debug=args.debug)
+        asyncio.run(run(args, startup), debug=args.debug)
 
 
 if __name__ == '__main__':
@@ -19,7 +19,7 @@ from __future__ import annotations
 
 import asyncio
 
-from typing import Any, ClassVar, Dict, List, Optional, Sequence, Tuple, Type
+from typing import Any, Callable, ClassVar, Dict, List, Optional, Sequence, Tuple, Type
 
 from .router import Endpoint, Router, RoutingRule
 
@@ -27,19 +27,23 @@ from .router import Endpoint, Router, RoutingRule
 class ChannelRoutingRule(RoutingRule):
     table: Dict[str, List[Type[Channel]]]
 
-    def __init__(self, router: Router, channel_types: List[Type[Channel]]):
+    def __init__(self, router: Router, load_channel_types: Callable[[str], List[Type[Channel]]]):
         super().__init__(router)
+        self.load_channel_types = load_channel_types
         self.table = {}
 
-        # Sort the channels into buckets by payload type
-        for cls in channel_types:
-            entry = self.table.setdefault(cls.payload, [])
-            entry.append(cls)
+    def get_channel_types(self, payload: str) -> List[Type[Channel]]:
+        # The channel implementations for each payload get loaded on demand
+        try:
+            return self.table[payload]
+        except KeyError:
+            pass
 
-        # Within each bucket, sort the channels so those with more
-        # restrictions are considered first.
-        for entry in self.table.values():
-            entry.sort(key=lambda cls: len(cls.restrictions), reverse=True)
+        # Sort the channels so those with more restrictions are considered first.
+        entry = sorted(self.load_channel_types(payload), key=lambda cls: len(cls.restrictions), reverse=True)
+        if entry:
+            self.table[payload] = entry
+        return entry
 
     def check_restrictions(self, restrictions: Sequence[Tuple[str, object]], options: Dict[str, object]) -> bool:
         for key, expected_value in restrictions:
@@ -65,7 +69,7 @@ class ChannelRoutingRule(RoutingRule):
         if not isinstance(payload, str):
             return None
 
-        for cls in self.table.get(payload, []):
+        for cls in self.get_channel_types(payload):
             if self.check_restrictions(cls.restrictions, options):
                 return cls(self.router)
         else:
@@ -15,26 +15,34 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from .dbus import DBusChannel
-from .filesystem import FsListChannel, FsReadChannel, FsReplaceChannel, FsWatchChannel
-from .http import HttpChannel
-from .metrics import InternalMetricsChannel
-from .packages import PackagesChannel
-from .stream import SubprocessStreamChannel, UnixStreamChannel
-from .trivial import EchoChannel, NullChannel
+import importlib
 
+from typing import Dict, List, Type
 
-CHANNEL_TYPES = [
-    DBusChannel,
-    EchoChannel,
-    FsListChannel,
-    FsReadChannel,
-    FsReplaceChannel,
-    FsWatchChannel,
-    HttpChannel,
-    InternalMetricsChannel,
-    NullChannel,
-    PackagesChannel,
-    SubprocessStreamChannel,
-    UnixStreamChannel,
-]
+from ..channel import Channel
+
+# The channel implementations, by payload.  Some of them pull in big modules
+# (D-Bus introspection, ssl, http.client), so they only get imported on the
+# first open of one of their payloads, instead of on startup.
+CHANNEL_TYPES: Dict[str, List[str]] = {
+    'dbus-json3': ['.dbus:DBusChannel'],
+    'echo': ['.trivial:EchoChannel'],
+    'fslist1': ['.filesystem:FsListChannel'],
+    'fsread1': ['.filesystem:FsReadChannel'],
+    'fsreplace1': ['.filesystem:FsReplaceChannel'],
+    'fswatch1': ['.filesystem:FsWatchChannel'],
+    'http-stream1': ['.packages:PackagesChannel'],
+    'http-stream2': ['.http:HttpChannel'],
+    'metrics1': ['.metrics:InternalMetricsChannel'],
+    'null': ['.trivial:NullChannel'],
+    'stream': ['.stream:SubprocessStreamChannel', '.stream:UnixStreamChannel'],
+}
+
+
+def load_channel_types(payload: str) -> List[Type[Channel]]:
+    """Imports the implementations of the given payload"""
+    types = []
+    for name in CHANNEL_TYPES.get(payload, []):
+        module, _, cls = name.partition(':')
+        types.append(getattr(importlib.import_module(module, __name__), cls))
+    return types
@@ -38,17 +38,26 @@
 #   (for path_namespace watches that don't hit an ObjectManager)
 
 import asyncio
+import collections
 import errno
 import json
 import logging
+import weakref
 import xml.etree.ElementTree as ET
 
+from typing import Dict
+
 from systemd_ctypes import Bus, BusError, introspection
 
 from ..channel import Channel, ChannelError
 
 logger = logging.getLogger(__name__)
 
+# One SharedBus per bus connection.  The system and session buses are the same
+# connection for every channel, but each router has its own internal bus.
+default_buses: 'Dict[str, SharedBus]' = {}
+internal_buses: 'weakref.WeakKeyDictionary[object, SharedBus]' = weakref.WeakKeyDictionary()
+
 # The dbusjson3 payload
 #
 # This channel payload type translates JSON encoded messages on a
@@ -88,114 +97,239 @@ logger = logging.getLogger(__name__)
 #   perform a Introspect call, and consequently must delay sending the
 #   method reply until that call has finished.
 #
-# The Python bridge implements this delaying of messages with
-# coroutines and a fair mutex. Every message coming from D-Bus will
-# wait on the mutex for its turn to send its message on the Cockpit
-# channel, and will keep that mutex locked until it is done with
-# sending.  Since the mutex is fair, everyone will nicely wait in line
-# without messages getting re-ordered.
+# The Python bridge implements this delaying of messages with a queue of
+# output slots for each channel.  Everything that will produce messages
+# reserves a slot at the point where its place in the order is known: a
+# signal when it arrives, a method reply when it arrives, and a watch when
+# the client asks for it.  The work to produce the messages (introspection,
+# for example) can then go on concurrently, but the messages in a slot are
+# only sent once all of the slots before it have been sent.  Channels don't
+# wait for each other.
 #
 # The scenario above will play out like this:
 #
-# - While adding the initial "watch", the lock is held until the
-#   "meta" and "notify" messages have been sent.
+# - Adding the initial "watch" reserves a slot, which gets filled with the
+#   "meta", "notify" and reply messages once they are ready.  Signals
+#   arriving in the meantime go into later slots.
 #
 # - Later, when the InterfacesAdded signal comes in that has been
-#   triggered by the method call, the mutex will be locked while the
-#   necessary introspection is going on.
+#   triggered by the method call, it reserves a slot, and the necessary
+#   introspection starts.
 #
-# - The method reply will likely come while the mutex is locked, and
-#   the task for sending that reply on the Cockpit channel will enter
-#   the wait queue of the mutex.
+# - The method reply will likely come while that is going on.  It
+#   reserves the next slot, and that slot is filled immediately.
 #
-# - Once the introspection is done and the new "meta" and "notify"
-#   messages have been sent, the mutex is unlocked, the method reply
-#   task acquires it, and sends its message.
+# - Once the introspection is done, the slot of the signal gets its "meta"
+#   and "notify" messages, they get sent, and then the method reply.
 
 
 class InterfaceCache:
-    def __init__(self):
-        self.cache = {}
-        self.old = set()  # Interfaces already returned by get_interface_if_new
+    """Introspection data for one bus connection, shared by all of its channels
+
+    Interfaces are keyed on (destination, interface name) and kept in LRU
+    order.  Everything we know about a destination is dropped when that name
+    changes owner: the new owner may well implement different interfaces.
+    Concurrent introspection of the same object results in a single call.
+
+    We don't remember which interfaces an object has: objects can gain and
+    lose interfaces at any time, without telling us.
+    """
+    MAX_ENTRIES = 1000
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.cache = collections.OrderedDict()
+        self.pending = {}  # (destination, object_path) → introspection task
+        self.names = {}  # destination → NameOwnerChanged match slot
+        self.introspections = 0
+
+    def lookup(self, destination, interface_name):
+        key = (destination, interface_name)
+        try:
+            self.cache.move_to_end(key)
+        except KeyError:
+            return None
+        return self.cache[key]
+
+    def inject(self, destination, interfaces):
+        for name, interface in interfaces.items():
+            self.cache[(destination, name)] = interface
+            self.cache.move_to_end((destination, name))
+
+        while len(self.cache) > self.MAX_ENTRIES:
+            self.cache.popitem(last=False)
+
+    def invalidate(self, destination):
+        logger.debug('dropping introspection data for %s', destination)
+        for key in [key for key in self.cache if key[0] == destination]:
+            del self.cache[key]
+        # Introspections still in flight will return to their callers, but
+        # their results won't be cached, and later callers start over.
+        for key in [key for key in self.pending if key[0] == destination]:
+            del self.pending[key]
+
+    def watch_name(self, destination):
+        # The internal bus is peer-to-peer: nothing can change owner there
+        if destination is None or destination in self.names:
+            return
+
+        def owner_changed(message):
+            name, _old_owner, _new_owner = message.get_body()
+            self.invalidate(name)
 
-    def inject(self, interfaces):
-        self.cache.update(interfaces)
+        rule = ("type='signal',sender='org.freedesktop.DBus',path='/org/freedesktop/DBus',"
+                f"interface='org.freedesktop.DBus',member='NameOwnerChanged',arg0='{destination}'")
+        self.names[destination] = self.bus.add_match(rule, owner_changed)
 
-    async def introspect_path(self, bus, destination, object_path):
-        xml, = await bus.call_method_async(destination, object_path, 'org.freedesktop.DBus.Introspectable', 'Introspect')
+    async def do_introspect(self, destination, object_path):
+        self.introspections += 1
+        xml, = await self.bus.call_method_async(destination, object_path,
+                                                'org.freedesktop.DBus.Introspectable', 'Introspect')
 
         et = ET.fromstring(xml)
 
         interfaces = {tag.attrib['name']: introspection.parse_interface(tag) for tag in et.findall('interface')}
 
-        # Add all interfaces we found: we might use them later
-        self.inject(interfaces)
+        # Add all interfaces we found: we might use them later.  Unless the
+        # destination changed owner in the meantime: then they're stale.
+        if self.pending.get((destination, object_path)) is asyncio.current_task():
+            self.watch_name(destination)
+            self.inject(destination, interfaces)
 
         return interfaces
 
-    async def get_interface(self, interface_name, bus=None, destination=None, object_path=None):
+    async def introspect_path(self, destination, object_path):
+        key = (destination, object_path)
+        task = self.pending.get(key)
+
+        if task is None:
+            task = asyncio.create_task(self.do_introspect(destination, object_path))
+            self.pending[key] = task
+
+            def done(task):
+                if self.pending.get(key) is task:
+                    del self.pending[key]
+            task.add_done_callback(done)
+
+        # Our caller might get cancelled, but the others still want the result
+        return await asyncio.shield(task)
+
+
+class MatchRegistry:
+    """Match rules on one bus connection, shared by all of its channels
+
+    Each distinct rule is added to the bus once, however many handlers
+    subscribe to it, and every message that it matches is handed to all of
+    them.  The rule is removed again with its last handler.  Handlers are only
+    weakly referenced: the subscriber keeps them alive.
+    """
+    def __init__(self, bus):
+        self.bus = bus
+        self.rules = {}  # rule → (slot, handlers)
+        self.delivered = 0
+
+    def add(self, rule, handler):
         try:
-            return self.cache[interface_name]
+            _slot, handlers = self.rules[rule]
         except KeyError:
-            pass
+            handlers = weakref.WeakSet()
 
-        if bus and object_path:
-            try:
-                await self.introspect_path(bus, destination, object_path)
-            except BusError:
-                pass
+            def fan_out(message):
+                self.delivered += 1
+                for handler in list(handlers):
+                    handler(message)
+                if not handlers:
+                    # all of the subscribers went away without telling us
+                    asyncio.get_running_loop().call_soon(self.prune, rule)
 
-        return self.cache.get(interface_name)
+            self.rules[rule] = self.bus.add_match(rule, fan_out), handlers
 
-    async def get_interface_if_new(self, interface_name, bus, destination, object_path):
-        if interface_name in self.old:
-            return None
-        self.old.add(interface_name)
-        return await self.get_interface(interface_name, bus, destination, object_path)
+        handlers.add(handler)
+        return rule, handler
 
-    async def get_signature(self, interface_name, method, bus=None, destination=None, object_path=None):
-        interface = await self.get_interface(interface_name, bus, destination, object_path)
-        if interface is None:
-            raise KeyError(f'Interface {interface_name} is not found')
+    def remove(self, subscription):
+        rule, handler = subscription
+        _slot, handlers = self.rules[rule]
+        handlers.discard(handler)
+        self.prune(rule)
+
+    def prune(self, rule):
+        # Dropping the slot removes the match from the bus
+        if rule in self.rules and not self.rules[rule][1]:
+            del self.rules[rule]
 
-        return ''.join(interface['methods'][method]['in'])
+
+class SharedBus:
+    """The state that all channels on one bus connection have in common"""
+    def __init__(self, bus):
+        self.interfaces = InterfaceCache(bus)
+        self.matches = MatchRegistry(bus)
 
 
 def notify_update(notify, path, interface_name, props):
     notify.setdefault(path, {})[interface_name] = {k: v['v'] for k, v in props.items()}
 
 
+def notify_merge(notify, later):
+    # Combines two notify messages, with the later values winning.  None
+    # means that the interface was removed.  If later adds an interface back
+    # that notify removes, they can't be combined: the client has to see the
+    # removal first.  Then this returns False, and leaves notify alone.
+    for path, interfaces in later.items():
+        current = notify.get(path, {})
+        for name, props in interfaces.items():
+            if props is not None and name in current and current[name] is None:
+                return False
+
+    for path, interfaces in later.items():
+        current = notify.setdefault(path, {})
+        for name, props in interfaces.items():
+            if props is None or current.get(name) is None:
+                current[name] = props
+            else:
+                current[name].update(props)
+
+    return True
+
+
 class DBusChannel(Channel):
     payload = 'dbus-json3'
 
     tasks = None
     matches = None
+    match_registry = None
     name = None
     bus = None
 
-    # This needs to be a fair mutex so that outgoing messages don't
-    # get re-ordered.  asyncio.Lock is fair.
-    watch_processing_lock = asyncio.Lock()
+    output = None
+
+    # Well below the limit on pending replies per connection of dbus-daemon
+    MAX_CONCURRENT_CALLS = 32
 
     def do_open(self, options):
-        self.cache = InterfaceCache()
+        self.interfaces = {}  # given to us by the client in 'meta' messages
+        self.announced = set()  # interfaces that we sent 'meta' for
         self.name = options.get('name')
         self.matches = []
         self.tasks = set()
+        self.output = collections.deque()
 
         bus = options.get('bus')
 
         if bus == 'internal':
             logger.debug('get internal bus for %s', self.name)
             self.bus = self.router.internal_bus.client
+            buses, key = internal_buses, self.router.internal_bus
         else:
             try:
                 if bus == 'session':
                     logger.debug('get session bus for %s', self.name)
                     self.bus = Bus.default_user()
+                    buses, key = default_buses, 'session'
                 else:
                     logger.debug('get system bus for %s', self.name)
                     self.bus = Bus.default_system()
+                    buses, key = default_buses, 'system'
             except OSError as exc:
                 raise ChannelError('protocol-error', message=f'failed to connect to {bus} bus: {exc}') from exc
 
@@ -205,14 +339,121 @@ class DBusChannel(Channel):
             if err.errno != errno.EBUSY:
                 raise
 
+        try:
+            shared = buses[key]
+        except KeyError:
+            shared = buses[key] = SharedBus(self.bus)
+        self.cache = shared.interfaces
+        self.match_registry = shared.matches
+
         self.ready()
 
+    async def get_interface(self, interface_name, object_path=None):
+        interface = self.interfaces.get(interface_name) or self.cache.lookup(self.name, interface_name)
+
+        if interface is None and object_path is not None:
+            try:
+                interfaces = await self.cache.introspect_path(self.name, object_path)
+                interface = interfaces.get(interface_name)
+            except BusError:
+                pass
+
+        return interface
+
+    async def get_interface_if_new(self, interface_name, object_path):
+        if interface_name in self.announced:
+            return None
+        self.announced.add(interface_name)
+        return await self.get_interface(interface_name, object_path)
+
+    async def get_signature(self, interface_name, method, object_path=None):
+        interface = await self.get_interface(interface_name, object_path)
+        if interface is None:
+            raise KeyError(f'Interface {interface_name} is not found')
+
+        return ''.join(interface['methods'][method]['in'])
+
+    def create_task(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def reserve_output(self):
+        # Returns a future for a list of messages, to be sent after everything
+        # that was reserved before it.
+        slot = asyncio.get_running_loop().create_future()
+        slot.add_done_callback(self.flush_output)
+        self.output.append(slot)
+        return slot
+
+    def flush_output(self, _slot=None):
+        # Everything that became ready since the last flush goes out now, with
+        # runs of notify messages merged into one.  That turns a burst of
+        # PropertiesChanged signals into a single message.
+        notify = None
+
+        while self.output and self.output[0].done():
+            for message in self.output.popleft().result():
+                if message.keys() == {'notify'}:
+                    if notify is not None and not notify_merge(notify, message['notify']):
+                        self.send_message(notify=notify)
+                        notify = None
+                    if notify is None:
+                        notify = message['notify']
+                elif message.keys() == {'meta'} and not message['meta']:
+                    continue
+                else:
+                    if notify is not None:
+                        self.send_message(notify=notify)
+                        notify = None
+                    self.send_message(**message)
+
+        if notify is not None:
+            self.send_message(notify=notify)
+
+    def send_ordered(self, **kwargs):
+        self.reserve_output().set_result([kwargs])
+
+    def dispatch(self, coroutine):
+        # Runs coroutine, sending the list of messages that it returns in the
+        # order of calls to this function.
+        slot = self.reserve_output()
+
+        def done(task):
+            if task.cancelled():
+                slot.set_result([])
+            elif task.exception() is not None:
+                logger.error('dbus-json3 channel task failed', exc_info=task.exception())
+                slot.set_result([])
+            else:
+                slot.set_result(task.result())
+
+        self.create_task(coroutine).add_done_callback(done)
+
+    async def gather_calls(self, coroutines):
+        # Runs the coroutines concurrently, but never more than
+        # MAX_CONCURRENT_CALLS at a time, and returns their results in order.
+        # That way, setting up a watch takes about as long as the slowest of
+        # the calls instead of all of them together.
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_CALLS)
+
+        async def bounded(coroutine):
+            async with semaphore:
+                return await coroutine
+
+        return await asyncio.gather(*(bounded(coroutine) for coroutine in coroutines))
+
     def add_match(self, rule, handler):
         def sync_handler(message):
-            task = asyncio.create_task(handler(message))
-            self.tasks.add(task)
-            task.add_done_callback(self.tasks.discard)
-        self.matches.append(self.bus.add_match(rule, sync_handler))
+            self.dispatch(handler(message))
+        # This also keeps sync_handler alive for as long as we are
+        self.matches.append(self.match_registry.add(rule, sync_handler))
+
+    def do_close(self):
+        for subscription in self.matches:
+            self.match_registry.remove(subscription)
+        self.matches = []
 
     async def do_call(self, call, message):
         path, iface, method, args = call
@@ -232,50 +473,48 @@ class DBusChannel(Channel):
         if signature is None:
             try:
                 logger.debug('Doing introspection request for %s %s', iface, method)
-                signature = await self.cache.get_signature(iface, method, self.bus, self.name, path)
+                signature = await self.get_signature(iface, method, path)
             except BusError as error:
-                self.send_message(error=[error.name, [f'Introspection: {error.message}']], id=cookie)
+                self.send_ordered(error=[error.name, [f'Introspection: {error.message}']], id=cookie)
                 return
             except KeyError:
-                self.send_message(error=["org.freedesktop.DBus.Error.UnknownMethod",
+                self.send_ordered(error=["org.freedesktop.DBus.Error.UnknownMethod",
                                          [f"Introspection data for method {iface} {method} not available"]], id=cookie)
                 return
             except Exception as exc:
-                self.send_message(error=['python.error', [f'Introspection: {str(exc)}']], id=cookie)
+                self.send_ordered(error=['python.error', [f'Introspection: {str(exc)}']], id=cookie)
                 return
 
         try:
             reply = await self.bus.call_method_async(self.name, path, iface, method, signature, *args,
                                                      timeout=timeout)
             # If the method call has kicked off any signals related to
-            # watch processing, wait for that to be done.
-            async with self.watch_processing_lock:
-                # TODO: stop hard-coding the endian flag here.
-                self.send_message(reply=[reply], id=cookie,
-                                  flags="<" if flags is not None else None,
-                                  type=type)
+            # watch processing, the reply gets queued up behind them.
+            # TODO: stop hard-coding the endian flag here.
+            self.send_ordered(reply=[reply], id=cookie,
+                              flags="<" if flags is not None else None,
+                              type=type)
         except BusError as error:
             # actually, should send the fields from the message body
-            self.send_message(error=[error.name, [error.message]], id=cookie)
+            self.send_ordered(error=[error.name, [error.message]], id=cookie)
         except Exception as exc:
-            self.send_message(error=['python.error', [str(exc)]], id=cookie)
+            self.send_ordered(error=['python.error', [str(exc)]], id=cookie)
 
     async def do_add_match(self, add_match, message):
         logger.debug('adding match %s', add_match)
 
         async def match_hit(message):
             logger.debug('got match')
-            async with self.watch_processing_lock:
-                self.send_message(signal=[
-                    message.get_path(),
-                    message.get_interface(),
-                    message.get_member(),
-                    list(message.get_body())
-                ])
+            return [dict(signal=[
+                message.get_path(),
+                message.get_interface(),
+                message.get_member(),
+                list(message.get_body())
+            ])]
 
         rule = ','.join(f"{key}='{value}'" for key, value in add_match.items())
         self.add_match("type='signal'," + rule, match_hit)
-        self.send_message(reply=[], id=message.get('id'))
+        self.send_ordered(reply=[], id=message.get('id'))
 
     async def setup_objectmanager_watch(self, path, interface_name, meta, notify):
         # Watch the objects managed by the ObjectManager at "path".
@@ -289,21 +528,19 @@ class DBusChannel(Channel):
                 logger.debug('interfaces added %s %s', path, interface_props)
                 meta = {}
                 notify = {}
-                async with self.watch_processing_lock:
-                    for name, props in interface_props.items():
-                        if interface_name is None or name == interface_name:
-                            mm = await self.cache.get_interface_if_new(name, self.bus, self.name, path)
-                            if mm:
-                                meta.update({name: mm})
-                            notify_update(notify, path, name, props)
-                    self.send_message(meta=meta)
-                    self.send_message(notify=notify)
+                for name, props in interface_props.items():
+                    if interface_name is None or name == interface_name:
+                        mm = await self.get_interface_if_new(name, path)
+                        if mm:
+                            meta.update({name: mm})
+                        notify_update(notify, path, name, props)
+                return [dict(meta=meta), dict(notify=notify)]
             elif member == "InterfacesRemoved":
                 (path, interfaces) = message.get_body()
                 logger.debug('interfaces removed %s %s', path, interfaces)
-                async with self.watch_processing_lock:
-                    notify = {path: {name: None for name in interfaces}}
-                    self.send_message(notify=notify)
+                notify = {path: {name: None for name in interfaces}}
+                return [dict(notify=notify)]
+            return []
 
         rule = "type='signal'"
         if self.name:
@@ -311,32 +548,42 @@ class DBusChannel(Channel):
         rule += f",path='{path}',interface='org.freedesktop.DBus.ObjectManager'"
         self.add_match(rule, handler)
         objects, = await self.bus.call_method_async(self.name, path, 'org.freedesktop.DBus.ObjectManager', 'GetManagedObjects')
+        new = []
         for p, ifaces in objects.items():
             for iface, props in ifaces.items():
                 if interface_name is None or iface == interface_name:
-                    mm = await self.cache.get_interface_if_new(iface, self.bus, self.name, p)
-                    if mm:
-                        meta.update({iface: mm})
+                    if iface not in self.announced:
+                        self.announced.add(iface)
+                        new.append((iface, p))
                     notify_update(notify, p, iface, props)
 
+        interfaces = await self.gather_calls(self.get_interface(iface, p) for iface, p in new)
+        for (iface, _p), mm in zip(new, interfaces):
+            if mm:
+                meta.update({iface: mm})
+
     async def setup_path_watch(self, path, interface_name, recursive_props, meta, notify):
         # Watch a single object at "path", but maybe also watch for
         # property changes for all objects below "path".
 
         async def handler(message):
-            async with self.watch_processing_lock:
-                path = message.get_path()
-                name, props, invalids = message.get_body()
-                logger.debug('NOTIFY: %s %s %s %s', path, name, props, invalids)
-                # TODO - call Get for all invalids
-                notify = {}
-                notify_update(notify, path, name, props)
-                self.send_message(notify=notify)
-
-        this_meta = await self.cache.introspect_path(self.bus, self.name, path)
-        if interface_name is not None:
-            interface = this_meta.get(interface_name)
+            path = message.get_path()
+            name, props, invalids = message.get_body()
+            logger.debug('NOTIFY: %s %s %s %s', path, name, props, invalids)
+            # TODO - call Get for all invalids
+            notify = {}
+            notify_update(notify, path, name, props)
+            return [dict(notify=notify)]
+
+        # If we already know the interface, there's nothing to introspect
+        interface = self.cache.lookup(self.name, interface_name) if interface_name is not None else None
+        if interface is not None:
             this_meta = {interface_name: interface}
+        else:
+            this_meta = await self.cache.introspect_path(self.name, path)
+            if interface_name is not None:
+                interface = this_meta.get(interface_name)
+                this_meta = {interface_name: interface}
         meta.update(this_meta)
         rule = "type='signal'"
         if self.name:
@@ -347,14 +594,18 @@ class DBusChannel(Channel):
             rule += f",path='{path}'"
         rule += ",interface='org.freedesktop.DBus.Properties'"
         self.add_match(rule, handler)
-        for name, interface in meta.items():
-            if name.startswith("org.freedesktop.DBus."):
-                continue
+
+        async def get_all(name):
             try:
                 props, = await self.bus.call_method_async(self.name, path, 'org.freedesktop.DBus.Properties', 'GetAll', 's', name)
-                notify_update(notify, path, name, props)
+                return props
             except BusError:
-                pass
+                return None
+
+        names = [name for name in meta if not name.startswith("org.freedesktop.DBus.")]
+        for name, props in zip(names, await self.gather_calls(get_all(name) for name in names)):
+            if props is not None:
+                notify_update(notify, path, name, props)
 
     async def do_watch(self, watch, message):
         path = watch.get('path')
@@ -367,41 +618,34 @@ class DBusChannel(Channel):
 
         if path is None or cookie is None:
             logger.debug('ignored incomplete watch request %s', message)
-            self.send_message(error=['x.y.z', ['Not Implemented']], id=cookie)
-            self.send_message(reply=[], id=cookie)
-            return
+            return [dict(error=['x.y.z', ['Not Implemented']], id=cookie), dict(reply=[], id=cookie)]
 
         try:
-            async with self.watch_processing_lock:
-                meta = {}
-                notify = {}
-                await self.setup_path_watch(path, interface_name, recursive, meta, notify)
-                if recursive:
-                    await self.setup_objectmanager_watch(path, interface_name, meta, notify)
-                self.send_message(meta=meta)
-                self.send_message(notify=notify)
-                self.send_message(reply=[], id=message['id'])
+            meta = {}
+            notify = {}
+            await self.setup_path_watch(path, interface_name, recursive, meta, notify)
+            if recursive:
+                await self.setup_objectmanager_watch(path, interface_name, meta, notify)
+            return [dict(meta=meta), dict(notify=notify), dict(reply=[], id=message['id'])]
         except BusError as error:
-            self.send_message(error=[error.name, [error.message]], id=cookie)
+            return [dict(error=[error.name, [error.message]], id=cookie)]
 
     async def do_meta(self, meta, message):
-        self.cache.inject(meta)
+        # Not shared: the client's idea of an interface is its own business
+        self.interfaces.update(meta)
 
     def do_data(self, data):
         message = json.loads(data)
         logger.debug('receive dbus request %s %s', self.name, message)
 
         if call := message.get('call'):
-            task = asyncio.create_task(self.do_call(call, message))
+            self.create_task(self.do_call(call, message))
         elif add_match := message.get('add-match'):
-            task = asyncio.create_task(self.do_add_match(add_match, message))
+            self.create_task(self.do_add_match(add_match, message))
         elif watch := message.get('watch'):
-            task = asyncio.create_task(self.do_watch(watch, message))
+            # Signals that arrive while we set up the watch get sent after it
+            self.dispatch(self.do_watch(watch, message))
         elif meta := message.get('meta'):
-            task = asyncio.create_task(self.do_meta(meta, message))
+            self.create_task(self.do_meta(meta, message))
         else:
             logger.debug('ignored dbus request %s', message)
-            return
-
-        self.tasks.add(task)
-        task.add_done_callback(self.tasks.discard)
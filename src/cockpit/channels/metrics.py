@@ -15,8 +15,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import array
 import asyncio
 import json
+import math
+import struct
 import sys
 import time
 import logging
@@ -39,11 +42,15 @@ class InternalMetricsChannel(AsyncChannel):
     restrictions = [('source', 'internal')]
 
     metrics: List[MetricInfo]
+    instances: List[List[str]]
     samplers: Set
     samplers_cache: Optional[Dict[str, Tuple[Sampler, SampleDescription]]] = None
 
     interval: int = 1000
     need_meta: bool = True
+    delta_meta: bool = False
+    data_encoding: str = 'json'
+    sent_meta: bool = False
     last_timestamp: float = 0
     next_timestamp: float = 0
 
@@ -61,6 +68,18 @@ class InternalMetricsChannel(AsyncChannel):
 
         self.interval = interval
 
+        delta_meta = options.get('delta-meta', False)
+        if not isinstance(delta_meta, bool):
+            raise ChannelError('protocol-error', message=f'invalid "delta-meta" value: {delta_meta}')
+
+        self.delta_meta = delta_meta
+
+        data_encoding = options.get('data-encoding', self.data_encoding)
+        if data_encoding not in ['json', 'float64']:
+            raise ChannelError('protocol-error', message=f'invalid "data-encoding" value: {data_encoding}')
+
+        self.data_encoding = data_encoding
+
         metrics = options.get('metrics')
         if not isinstance(metrics, list) or len(metrics) == 0:
             logger.error('invalid "metrics" value: %s', metrics)
@@ -84,26 +103,32 @@ class InternalMetricsChannel(AsyncChannel):
 
             sampler_classes.add(sampler)
             self.metrics.append(MetricInfo(derive=derive, desc=desc))
+            self.instances.append([])
 
         self.samplers = {cls() for cls in sampler_classes}
 
-    def send_meta(self, samples: Dict[str, Any], timestamp: float):
-        metrics = []
-        for metricinfo in self.metrics:
-            if metricinfo.desc.instanced:
-                metrics.append({
-                    'name': metricinfo.desc.name,
-                    'units': metricinfo.desc.units,
-                    'instances': list(samples[metricinfo.desc.name].keys()),
-                    'semantics': metricinfo.desc.semantics
-                })
-            else:
-                metrics.append({
-                    'name': metricinfo.desc.name,
-                    'derive': metricinfo.derive,
-                    'units': metricinfo.desc.units,
-                    'semantics': metricinfo.desc.semantics
-                })
+    def send_meta(self, timestamp: float, changes: List[Dict[str, List[str]]]):
+        metrics: List[Dict[str, Any]] = []
+        if self.delta_meta and self.sent_meta:
+            # Only describe how the instance lists changed: removed instances
+            # are dropped from the list, and added ones appended at the end.
+            metrics = changes
+        else:
+            for metricinfo, instances in zip(self.metrics, self.instances):
+                if metricinfo.desc.instanced:
+                    metrics.append({
+                        'name': metricinfo.desc.name,
+                        'units': metricinfo.desc.units,
+                        'instances': instances,
+                        'semantics': metricinfo.desc.semantics
+                    })
+                else:
+                    metrics.append({
+                        'name': metricinfo.desc.name,
+                        'derive': metricinfo.derive,
+                        'units': metricinfo.desc.units,
+                        'semantics': metricinfo.desc.semantics
+                    })
 
         meta = {
             'timestamp': timestamp * 1000,
@@ -111,8 +136,11 @@ class InternalMetricsChannel(AsyncChannel):
             'source': 'internal',
             'metrics': metrics
         }
+        if self.delta_meta and self.sent_meta:
+            meta['delta'] = True
         self.send_message(**meta)
         self.need_meta = False
+        self.sent_meta = True
 
     def sample(self):
         samples = defaultdict(dict)
@@ -126,42 +154,89 @@ class InternalMetricsChannel(AsyncChannel):
         else:
             return False
 
+    def update_instances(self, index: int, value: Dict[str, Any]) -> Dict[str, List[str]]:
+        # Keep the order of the instances stable: existing instances keep their
+        # relative position and new ones get added at the end.
+        instances = self.instances[index]
+        if len(value) == len(instances) and all(instance in value for instance in instances):
+            return {}
+
+        known = set(instances)
+        removed = [instance for instance in instances if instance not in value]
+        added = [instance for instance in value if instance not in known]
+        self.instances[index] = [instance for instance in instances if instance in value] + added
+
+        change = {}
+        if removed:
+            change['removed'] = removed
+        if added:
+            change['added'] = added
+        return change
+
+    @staticmethod
+    def encode_float64(data: List[Any]) -> bytes:
+        # A header with a version and the number of values, followed by one
+        # little-endian float64 per slot.  Missing values become NaN.
+        # That includes the {} we get for a non-instanced metric that wasn't
+        # sampled, such as cpu.pressure on a kernel booted with psi=0.
+        def as_float(value):
+            if isinstance(value, (int, float)) and value is not False:
+                return value
+            return math.nan
+
+        values = array.array('d')
+        for value in data:
+            if isinstance(value, list):
+                values.extend(as_float(item) for item in value)
+            else:
+                values.append(as_float(value))
+
+        if sys.byteorder != 'little':
+            values.byteswap()
+
+        return struct.pack('<II', 1, len(values)) + values.tobytes()
+
     def send_updates(self, samples: Dict[str, Any], last_samples: Dict[str, Any]):
         data = []
+        changes = []
         timestamp = time.time()
         self.next_timestamp = timestamp
 
-        for metricinfo in self.metrics:
+        for index, metricinfo in enumerate(self.metrics):
             value = samples[metricinfo.desc.name]
             old_value = last_samples[metricinfo.desc.name]
 
             if metricinfo.desc.instanced:
                 # If we have less or more keys the data changed, send a meta message.
-                if value.keys() != old_value.keys():
+                change = self.update_instances(index, value)
+                if change:
                     self.need_meta = True
+                changes.append(change)
 
+                instances = self.instances[index]
                 if metricinfo.derive == 'rate':
-                    instances = []
-                    for key, val in value.items():
-                        instances.append(self.calculate_sample_rate(val, old_value.get(key)))
-
-                    data.append(instances)
+                    data.append([self.calculate_sample_rate(value[key], old_value.get(key)) for key in instances])
                 else:
-                    data.append([val for val in value.values()])
+                    data.append([value[key] for key in instances])
             else:
+                changes.append({})
                 if metricinfo.derive == 'rate':
                     data.append(self.calculate_sample_rate(value, old_value))
                 else:
                     data.append(value)
 
         if self.need_meta:
-            self.send_meta(samples, timestamp)
+            self.send_meta(timestamp, changes)
 
         self.last_timestamp = self.next_timestamp
-        self.send_data(json.dumps([data]).encode())
+        if self.data_encoding == 'float64':
+            self.send_data(self.encode_float64(data))
+        else:
+            self.send_data(json.dumps([data]).encode())
 
     async def run(self, options):
         self.metrics = []
+        self.instances = []
         self.samplers = set()
 
         InternalMetricsChannel.ensure_samplers()
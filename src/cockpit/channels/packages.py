@@ -17,46 +17,60 @@
 
 import logging
 
-from ..channel import Channel
+from ..channel import AsyncChannel
 
 logger = logging.getLogger(__name__)
 
 
-class PackagesChannel(Channel):
+class PackagesChannel(AsyncChannel):
     payload = 'http-stream1'
     restrictions = [("internal", "packages")]
 
+    # Bodies are sent in blocks of this size, subject to flow control
+    BLOCK_SIZE = 64 * 1024
+
     headers = None
     protocol = None
     host = None
     origin = None
     out_headers = None
-    options = None
-    post = None
+    body = None
 
     def push_header(self, key, value):
         if self.out_headers is None:
             self.out_headers = {}
         self.out_headers[key] = value
 
-    def http_ok(self, content_type, extra_headers=None):
-        headers = {'Content-Type': content_type}
+    def send_headers(self, status, reason, headers):
         if self.out_headers is not None:
-            headers.update(self.out_headers)
-        if extra_headers is not None:
-            headers.update(extra_headers)
-        self.send_message(status=200, reason='OK', headers={k: v for k, v in headers.items() if v is not None})
+            headers = dict(self.out_headers, **headers)
+        self.send_message(status=status, reason=reason, headers={k: v for k, v in headers.items() if v is not None})
+
+    def http_ok(self, content_type, extra_headers=None):
+        self.send_headers(200, 'OK', dict({'Content-Type': content_type}, **(extra_headers or {})))
+
+    def http_not_modified(self, extra_headers=None):
+        # no body follows
+        self.send_headers(304, 'Not Modified', extra_headers or {})
 
     def http_error(self, status, message):
         self.send_message(status=status, reason='ERROR')
-        self.send_data(message.encode('utf-8'))
+        self.send_body(message.encode('utf-8'))
+
+    def send_body(self, data):
+        self.body = data
 
-    def do_done(self):
-        assert not self.post
-        assert self.options['method'] == 'GET'
-        path = self.options['path']
+    async def run(self, options):
+        self.ready()
 
-        self.headers = self.options['headers']
+        # We only support GET, so there is no body to read: just wait for EOF
+        while await self.read():
+            pass
+
+        assert options['method'] == 'GET'
+        path = options['path']
+
+        self.headers = options['headers']
         self.protocol = self.headers['X-Forwarded-Proto']
         self.host = self.headers['X-Forwarded-Host']
         self.origin = f'{self.protocol}://{self.host}'
@@ -66,12 +80,9 @@ class PackagesChannel(Channel):
         except FileNotFoundError:
             self.http_error(404, 'Not Found')
 
-        self.done()
-
-    def do_data(self, data):
-        self.post += data
+        if self.body:
+            body = memoryview(self.body)
+            for offset in range(0, len(body), self.BLOCK_SIZE):
+                await self.write(body[offset:offset + self.BLOCK_SIZE])
 
-    def do_open(self, options):
-        self.post = b''
-        self.options = options
-        self.ready()
+        self.done()
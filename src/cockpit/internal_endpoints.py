@@ -16,6 +16,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import grp
+import json
 import logging
 import os
 import pwd
@@ -24,6 +25,8 @@ from typing import Optional
 
 from systemd_ctypes import bus
 
+from .packages import Packages, PackagesListener
+
 logger = logging.getLogger(__name__)
 
 
@@ -76,8 +79,28 @@ class cockpit_Machines(bus.Object):
         ...
 
 
-class cockpit_Packages(bus.Object):
-    ...
+class cockpit_Packages(PackagesListener, bus.Object):
+    manifests = bus.Interface.Property('s', value='{}')
+    reload_hinted = False
+
+    def __init__(self, packages: Packages):
+        self.packages = packages
+        self.packages_loaded()
+
+    def packages_loaded(self) -> None:
+        self.manifests = json.dumps({name: package.manifest for name, package in self.packages.packages.items()})
+
+    @bus.Interface.Method()
+    def reload(self) -> None:
+        self.packages.reload()
+
+    @bus.Interface.Method()
+    def reload_hint(self) -> None:
+        # The shell calls this each time it gets loaded.  Nothing happens for
+        # the first call, which comes right after login.
+        if self.reload_hinted:
+            self.packages.reload()
+        self.reload_hinted = True
 
 
 class cockpit_User(bus.Object):
@@ -102,6 +125,5 @@ EXPORTS = [
     ('/LoginMessages', cockpit_LoginMessages),
     ('/config', cockpit_Config),
     ('/machines', cockpit_Machines),
-    ('/packages', cockpit_Packages),
     ('/user', cockpit_User),
 ]
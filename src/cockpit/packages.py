@@ -16,22 +16,56 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import asyncio
 import collections
+import functools
 import hashlib
+import io
+import itertools
 import json
 import fnmatch
 import logging
 import mimetypes
+import mmap
 import os
-import pkg_resources
-import zipfile
+import struct
 
+# These modules are imported where they get used instead, to keep them off the
+# startup path of the bridge: concurrent.futures, email.utils, gzip, tempfile
+# and zipfile.
+
+from datetime import timezone
 from pathlib import Path
 
-VERSION = pkg_resources.parse_version('300')
 logger = logging.getLogger('cockpit.packages')
 
 
+def parse_version(version):
+    """Turns a version like '266.1' into a tuple that compares as expected
+
+    This is enough for the "requires" of a manifest, which only has numbers,
+    and avoids importing pkg_resources, which takes a long time.  Anything
+    after the first non-numeric part is ignored.
+    """
+    parts = []
+    for part in str(version).split('.'):
+        digits = ''.join(itertools.takewhile(str.isdigit, part))
+        if not digits:
+            break
+        parts.append(int(digits))
+        if digits != part:
+            break
+
+    # '300' and '300.0' are the same version
+    while parts and parts[-1] == 0:
+        parts.pop()
+
+    return tuple(parts)
+
+
+VERSION = parse_version('300')
+
+
 # Sorting is important because the checksums are dependent on the order we
 # visit these.  This is not the same as sorting on the full pathname, since
 # each directory component is considered separately.  We could split the path
@@ -43,7 +77,269 @@ def directory_items(path):
     return sorted(path.iterdir(), key=lambda item: item.name)
 
 
+@functools.lru_cache()
+def parse_accept_language(header):
+    """Returns the preferred locale of an Accept-Language header, or None
+
+    The language tag is converted to the form used in our file names, so
+    'de-de' becomes 'de_DE'.  Browsers send the same header all the time, so
+    the results are cached.
+    """
+    languages = []
+    for item in header.split(','):
+        language, _, params = item.partition(';')
+        language = language.strip().lower()
+
+        qvalue = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+
+        if language and language != '*' and qvalue > 0:
+            languages.append((qvalue, language))
+
+    if not languages:
+        return None
+
+    # max() returns the first of equally preferred languages
+    _, language = max(languages, key=lambda item: item[0])
+    language, _, region = language.partition('-')
+    return f'{language}_{region.upper()}' if region else language
+
+
+@functools.lru_cache()
+def accepts_gzip(header):
+    """Checks if an Accept-Encoding header allows gzip"""
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        if coding.strip().lower() in ('gzip', '*'):
+            key, _, value = params.strip().partition('=')
+            try:
+                return key != 'q' or float(value) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def not_modified(headers, etag, mtime):
+    """Checks the conditional request headers against the validators of a file
+
+    If-None-Match takes precedence over If-Modified-Since, as per RFC 7232.
+    """
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        # GET requests use the weak comparison
+        tags = {tag.strip() for tag in if_none_match.split(',')}
+        tags = {tag[2:] if tag.startswith('W/') else tag for tag in tags}
+        return '*' in tags or etag in tags
+
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since is not None and mtime is not None:
+        import email.utils
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return int(mtime) <= since.timestamp()
+
+    return False
+
+
+class DigestCache:
+    """A persistent cache of the SHA-256 digests of package files
+
+    Computing the package checksum requires hashing every file of every
+    package, which is most of the startup time of the bridge on hosts with
+    many packages.  Entries are keyed on the path and validated against the
+    inode, mtime and size of the file, so only changed files get rehashed.
+
+    The cache lives in $XDG_CACHE_HOME (or $XDG_RUNTIME_DIR if that isn't
+    writable) and saving it is best effort.  Only the entries that were used
+    get saved, so files of removed packages disappear from it.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.used = {}
+        self.dirty = False
+
+        cachedir = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        self.filenames = [f'{cachedir}/cockpit/package-digests.json']
+        if runtimedir := os.environ.get('XDG_RUNTIME_DIR'):
+            self.filenames.append(f'{runtimedir}/cockpit/package-digests.json')
+
+        for filename in self.filenames:
+            try:
+                with open(filename, encoding='utf-8') as file:
+                    entries = json.load(file)
+            except (OSError, ValueError):
+                continue
+
+            if self.is_valid(entries):
+                self.entries = entries
+            break
+
+    @staticmethod
+    def is_valid(entries):
+        return isinstance(entries, dict) and all(
+            isinstance(entry, list) and len(entry) == 4 and isinstance(entry[3], str) for entry in entries.values()
+        )
+
+    # Reading big files in one go would need a big buffer: map them instead.
+    # In both cases, hashlib releases the GIL while it does the work.
+    MMAP_THRESHOLD = 1024 * 1024
+    MAX_WORKERS = 4
+
+    @staticmethod
+    def hash_file(path):
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size < DigestCache.MMAP_THRESHOLD:
+                return hashlib.sha256(file.read()).hexdigest()
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return hashlib.sha256(data).hexdigest()
+
+    def get_digests(self, paths):
+        """Returns the hex digests of the files in paths, in the same order
+
+        Files that aren't in the cache (or changed) are hashed in parallel.
+        """
+        entries = []
+        missing = []
+        for path in paths:
+            key = str(path)
+            buf = os.stat(key)
+            validator = [buf.st_ino, buf.st_mtime_ns, buf.st_size]
+            entry = self.entries.get(key)
+            if entry is None or entry[:3] != validator:
+                entry = validator + [None]
+                missing.append((key, entry))
+            entries.append(entry)
+            self.used[key] = entry
+
+        workers = min(self.MAX_WORKERS, os.cpu_count() or 1, len(missing))
+        if workers > 1:
+            import concurrent.futures
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                digests = list(pool.map(self.hash_file, (key for key, _ in missing)))
+        else:
+            digests = [self.hash_file(key) for key, _ in missing]
+
+        for (_, entry), digest in zip(missing, digests):
+            entry[3] = digest
+            self.dirty = True
+
+        return [entry[3] for entry in entries]
+
+    def save(self):
+        if not self.dirty and len(self.used) == len(self.entries):
+            return
+
+        import tempfile
+
+        for filename in self.filenames:
+            try:
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(filename),
+                                                 prefix='.package-digests-', delete=False) as file:
+                    json.dump(self.used, file)
+                os.rename(file.name, filename)
+            except OSError as exc:
+                logger.debug('Unable to save package digest cache to %s: %s', filename, exc)
+                continue
+
+            self.entries = dict(self.used)
+            self.dirty = False
+            break
+
+
+class FileCache:
+    """A byte-bounded LRU cache of file contents
+
+    The same few files (cockpit.js, the base1 CSS, translations) get served
+    for every page load in every session.  Entries are keyed on the path,
+    mtime and size, so changed files are never served stale.
+
+    The digests of the files are remembered separately (and for files of any
+    size) since they are small, and are all we need to answer a conditional
+    request.
+
+    Files bigger than max_item_size are read every time, but their gzipped
+    versions are cached as long as they fit: compressing costs a lot more
+    than reading.
+    """
+    def __init__(self, max_size=16 * 1024 * 1024, max_item_size=2 * 1024 * 1024):
+        self.entries = collections.OrderedDict()
+        self.digests = {}
+        self.size = 0
+        self.max_size = max_size
+        self.max_item_size = max_item_size
+
+    def read(self, path):
+        buf = os.stat(path)
+        key = (str(path), buf.st_mtime_ns, buf.st_size)
+
+        try:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        except KeyError:
+            pass
+
+        with open(path, 'rb') as file:
+            data = file.read()
+
+        if len(data) == buf.st_size:
+            self.add(key, data)
+
+        return data
+
+    def add(self, key, data, max_item_size=None):
+        if len(data) <= (max_item_size or self.max_item_size):
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def compress(self, digest, data):
+        """Returns data (with the given hex digest) compressed with gzip
+
+        Entries are keyed on the digest, so each version of a file only gets
+        compressed once, whichever path it is served from, until it's evicted.
+        """
+        key = ('gzip', digest)
+        try:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        except KeyError:
+            pass
+
+        import gzip
+        compressed = gzip.compress(data, compresslevel=6, mtime=0)
+        self.add(key, compressed, max_item_size=self.max_size)
+        return compressed
+
+    def digest(self, path):
+        """Returns the hex digest, the mtime and the size of the file at path"""
+        buf = os.stat(path)
+        validator = (buf.st_ino, buf.st_mtime_ns, buf.st_size)
+
+        entry = self.digests.get(str(path))
+        if entry is None or entry[0] != validator:
+            entry = (validator, DigestCache.hash_file(path))
+            self.digests[str(path)] = entry
+
+        return entry[1], buf.st_mtime, buf.st_size
+
+
 class Package:
+    # What this package contributes to the checksum, once computed
+    checksum_data = None
+
     def __init__(self, path):
         self.path = path
 
@@ -55,28 +351,39 @@ class Package:
         else:
             self.name = path.name
 
-        self.content_security_policy = None
+        self.content_security_policies = {}
         self.priority = self.manifest.get('priority', 1)
         self.bridges = self.manifest.get('bridges', [])
 
-        self.files = set()
-        for file in self.path.rglob('*'):
-            self.files.add(file.relative_to(self.path))
+    # Most packages are never opened during a session, so we only index their
+    # files on the first request.
+    @functools.cached_property
+    def files(self):
+        return {file.relative_to(self.path) for file in self.path.rglob('*')}
+
+    @functools.cached_property
+    def filenames(self):
+        return {str(file) for file in self.files}
 
-    def walk(self, checksums, path=None):
+    # The results of negotiate_file(), by requested path and locale.  Dropping
+    # internal extensions means that the set of paths resolving to a file is
+    # open-ended, so this is filled on demand instead of from self.files.
+    MAX_NEGOTIATED = 1024
+
+    @functools.cached_property
+    def negotiated(self):
+        return {}
+
+    def walk(self, files, path=None):
+        """Collects (name, path) for all files of the package, in checksum order"""
         if not path:
             path = self.path
 
         for item in directory_items(path):
             if item.is_dir():
-                self.walk(checksums, item)
+                self.walk(files, item)
             elif item.is_file():
-                rel = item.relative_to(path)
-                with item.open('rb') as file:
-                    data = file.read()
-                sha = hashlib.sha256(data).hexdigest()
-                for context in checksums:
-                    context.update(f'{rel}\0{sha}\0'.encode('ascii'))
+                files.append((item.relative_to(path), item))
 
     def check(self, at_least_prio):
         if 'requires' in self.manifest:
@@ -84,7 +391,7 @@ class Package:
             if any(package != 'cockpit' for package in requires):
                 return False
 
-            if 'cockpit' in requires and VERSION < pkg_resources.parse_version(requires['cockpit']):
+            if 'cockpit' in requires and VERSION < parse_version(requires['cockpit']):
                 return False
 
         if at_least_prio is not None:
@@ -106,30 +413,46 @@ class Package:
                 yield f'{base}.{locale}.{ext}.gz'
 
                 if '_' in locale:
-                    language, _, _ = locale.partition(' ')
+                    language, _, _ = locale.partition('_')
                     yield f'{base}.{language}.{ext}'
                     yield f'{base}.{language}.{ext}.gz'
 
             yield f'{base}.{ext}'
             yield f'{base}.min.{ext}'
-            yield f'{base}.{ext}'
             yield f'{base}.{ext}.gz'
             yield f'{base}.min.{ext}.gz'
 
             base, _, _stripped_ext = base.rpartition('.')
 
     def negotiate_file(self, path, headers):
-        dirname, sep, filename = path.rpartition('/')
-        locale = headers.get('Accept-Language', '').split(',')[0].strip()  # obviously fix this
+        """Returns (filename, content_type, encoding) for path, or None"""
+        locale = parse_accept_language(headers.get('Accept-Language', ''))
+
+        try:
+            return self.negotiated[path, locale]
+        except KeyError:
+            pass
 
+        result = None
+        dirname, sep, filename = path.rpartition('/')
         for variant in self.filename_variants(filename, locale):
             logger.debug('consider variant %s', variant)
-            if Path(f'{dirname}{sep}{variant}') in self.files:
-                return f'{dirname}{sep}{variant}'
+            if f'{dirname}{sep}{variant}' in self.filenames:
+                result = (f'{dirname}{sep}{variant}', *mimetypes.guess_type(variant))
+                break
 
-        return None
+        if len(self.negotiated) >= self.MAX_NEGOTIATED:
+            self.negotiated.clear()
+        self.negotiated[path, locale] = result
+        return result
 
     def get_content_security_policy(self, origin):
+        # This is the same for every HTML file served to a given origin
+        try:
+            return self.content_security_policies[origin]
+        except KeyError:
+            pass
+
         assert origin.startswith('http')
         origin_ws = origin.replace('http', 'ws', 1)
 
@@ -151,51 +474,282 @@ class Package:
                 key, _, value = item.strip().partition(' ')
                 policy[key] = value
 
-        return ' '.join(f'{k} {v};' for k, v in policy.items()) + ' block-all-mixed-content'
+        result = ' '.join(f'{k} {v};' for k, v in policy.items()) + ' block-all-mixed-content'
+        self.content_security_policies[origin] = result
+        return result
 
-    def serve_file(self, path, channel):
-        filename = self.negotiate_file(path, channel.headers)
+    # Smaller files don't get any smaller in a way that matters
+    MIN_COMPRESS_SIZE = 1024
 
-        if filename is None:
+    @staticmethod
+    def is_compressible(content_type):
+        return content_type is not None and (content_type.startswith('text/') or
+                                             content_type in ('application/javascript', 'application/json'))
+
+    def serve_file(self, path, channel, file_cache, conditional=True):
+        negotiated = self.negotiate_file(path, channel.headers)
+
+        if negotiated is None:
             logger.debug('path %s not in %s', path, self.files)
             channel.http_error(404, 'Not found')
             return
 
-        content_type, encoding = mimetypes.guess_type(filename)
+        filename, content_type, encoding = negotiated
+
+        item = self.path / filename
+        if isinstance(item, Path):
+            buf = item.stat()
+            mtime, size = buf.st_mtime, buf.st_size
+        else:
+            # files in our zipapp never change, and have no useful mtime
+            mtime, size = None, item.archive.members[item.at].file_size
+
+        # Text files which weren't shipped compressed get compressed by us
+        compressible = encoding is None and self.is_compressible(content_type)
+        compress = compressible and size >= self.MIN_COMPRESS_SIZE and \
+            accepts_gzip(channel.headers.get('Accept-Encoding', ''))
+
+        # We only need the digest for our ETag, or as the key of the
+        # compressed data
+        digest = None
+        if conditional or compress:
+            if isinstance(item, Path):
+                digest, mtime, size = file_cache.digest(item)
+            else:
+                digest = item.archive.digest(item.at)
+
+        validators = {
+            "Vary": "Accept-Encoding" if compressible else None,
+        }
+
+        # With a package checksum, cockpit-ws sets an ETag from it and answers
+        # conditional requests itself: ours would replace it.
+        if conditional:
+            # The digest is of the negotiated file, so it changes with the locale
+            etag = f'"{digest}-gzip"' if compress else f'"{digest}"'
+            validators["ETag"] = etag
+            if mtime is not None:
+                import email.utils
+                validators["Last-Modified"] = email.utils.formatdate(mtime, usegmt=True)
+            if not_modified(channel.headers, etag, mtime):
+                channel.http_not_modified(validators)
+                return
+
+        if isinstance(item, Path):
+            data = file_cache.read(item)
+        else:
+            data = item.read_bytes()
+
+        if compress:
+            data = file_cache.compress(digest, data)
+            encoding = 'gzip'
+
+        headers = {
+            "Access-Control-Allow-Origin": channel.origin,
+            "Content-Encoding": encoding,
+            **validators,
+        }
+        if content_type is not None and content_type.startswith('text/html'):
+            headers['Content-Security-Policy'] = self.get_content_security_policy(channel.origin)
+        channel.http_ok(content_type, headers)
+        channel.send_body(data)
+
+
+class ZipArchive:
+    """An indexed zip file, for serving the packages in our zipapp
+
+    zipfile.Path finds children by scanning all of the entries, every time.
+    Instead, we read the central directory once and index it.  Members that
+    are stored (not compressed) are served straight from a mapping of the
+    archive, and a few of the compressed ones are kept decompressed.
+    """
+    LOCAL_HEADER = struct.Struct('<4s22xHH')
+    ZIP_STORED = 0
+
+    def __init__(self, filename, max_cache_size=4 * 1024 * 1024):
+        import zipfile
+
+        self.filename = filename
+        self.zipfile = zipfile.ZipFile(filename)
+        self.members = {}
+        self.directories = {'': set()}
+
+        for info in self.zipfile.infolist():
+            name = info.filename.rstrip('/')
+            if info.is_dir():
+                self.directories.setdefault(name, set())
+            else:
+                self.members[name] = info
+
+            # zip files don't need to have entries for the directories
+            while name:
+                parent, _, child = name.rpartition('/')
+                self.directories.setdefault(parent, set()).add(child)
+                name = parent
+
+        with open(filename, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.cache = collections.OrderedDict()
+        self.cache_size = 0
+        self.max_cache_size = max_cache_size
+        self.digests = {}
+
+    def digest(self, name):
+        # Our members never change, so their digests can be kept forever
+        try:
+            return self.digests[name]
+        except KeyError:
+            digest = self.digests[name] = hashlib.sha256(self.read(name)).hexdigest()
+            return digest
+
+    def read(self, name):
+        try:
+            info = self.members[name]
+        except KeyError as exc:
+            raise FileNotFoundError(name) from exc
+
+        if info.compress_type == self.ZIP_STORED and not info.flag_bits & 0x1:
+            # The data follows the local header, which has its own lengths
+            signature, name_len, extra_len = self.LOCAL_HEADER.unpack_from(self.map, info.header_offset)
+            if signature == b'PK\x03\x04':
+                start = info.header_offset + self.LOCAL_HEADER.size + name_len + extra_len
+                return memoryview(self.map)[start:start + info.file_size]
+
+        try:
+            self.cache.move_to_end(name)
+            return self.cache[name]
+        except KeyError:
+            pass
+
+        data = self.zipfile.read(info)
+        if len(data) <= self.max_cache_size // 4:
+            self.cache[name] = data
+            self.cache_size += len(data)
+            while self.cache_size > self.max_cache_size:
+                _, evicted = self.cache.popitem(last=False)
+                self.cache_size -= len(evicted)
+
+        return data
+
+
+class ZipPath:
+    """A path in a ZipArchive, with the parts of the pathlib API that we use"""
+    def __init__(self, archive, at=''):
+        self.archive = archive
+        self.at = at
+
+    def __truediv__(self, name):
+        return ZipPath(self.archive, f'{self.at}/{name}' if self.at else str(name))
+
+    def __eq__(self, other):
+        return isinstance(other, ZipPath) and (self.archive, self.at) == (other.archive, other.at)
 
-        with (self.path / filename).open('rb') as file:
-            headers = {
-                "Access-Control-Allow-Origin": channel.origin,
-                "Content-Encoding": encoding,
-            }
-            if content_type is not None and content_type.startswith('text/html'):
-                headers['Content-Security-Policy'] = self.get_content_security_policy(channel.origin)
-            channel.http_ok(content_type, headers)
-            channel.send_data(file.read())
+    def __hash__(self):
+        return hash((self.archive, self.at))
 
+    def __str__(self):
+        return f'{self.archive.filename}/{self.at}'
 
-class ZipPathPolyfill(zipfile.Path):
-    def all_the_things(self, glob):
-        if self.is_file() and fnmatch.fnmatch(self.name, glob):
-            yield self
-        elif self.is_dir():
-            for item in self.iterdir():
-                yield from item.all_the_things(glob)
+    @property
+    def name(self):
+        return self.at.rpartition('/')[2]
 
-    def rglob(self, glob):
-        assert '/' not in glob
-        yield from self.all_the_things(glob)
+    def is_dir(self):
+        return self.at in self.archive.directories
+
+    def is_file(self):
+        return self.at in self.archive.members
+
+    def iterdir(self):
+        try:
+            children = self.archive.directories[self.at]
+        except KeyError as exc:
+            raise FileNotFoundError(str(self)) from exc
+        return (self / child for child in children)
+
+    def rglob(self, pattern):
+        prefix = f'{self.at}/' if self.at else ''
+        for name in itertools.chain(self.archive.directories, self.archive.members):
+            if name and name.startswith(prefix) and fnmatch.fnmatch(name.rpartition('/')[2], pattern):
+                yield ZipPath(self.archive, name)
 
     def relative_to(self, path):
-        x = str(self)
-        y = str(path)
-        assert x.startswith(y)
-        return Path(x[len(y):])
+        assert self.at.startswith(path.at)
+        return Path(self.at[len(path.at):].lstrip('/'))
+
+    def read_bytes(self):
+        return self.archive.read(self.at)
+
+    def open(self, mode='r', encoding=None):
+        data = self.read_bytes()
+        if 'b' in mode:
+            return io.BytesIO(data)
+        return io.StringIO(bytes(data).decode(encoding or 'utf-8'))
+
+
+class PackagesListener:
+    def packages_loaded(self) -> None:
+        """Called when the packages have been reloaded"""
+
+
+class PackagesWatch:
+    """Reports changes in a directory of packages, or in a package, to Packages"""
+
+    # inotify events which don't mean that anything changed
+    IN_ACCESS = 0x1
+    IN_CLOSE_NOWRITE = 0x10
+    IN_OPEN = 0x20
+
+    def __init__(self, packages, path, children):
+        # Only the bridge watches, so `--packages` doesn't need systemd_ctypes
+        from systemd_ctypes import PathWatch
+
+        self.packages = packages
+        self.path = path
+        self.children = children
+
+        # Don't report the initial state
+        self.active = False
+        self.watch = PathWatch(str(path), self)
+        self.active = True
+
+    def do_inotify_event(self, mask, _cookie, name):
+        if int(mask) & ~(self.IN_ACCESS | self.IN_CLOSE_NOWRITE | self.IN_OPEN) == 0:
+            return
+
+        if self.children and name:
+            self.packages.path_changed(self.path / os.fsdecode(name))
+        else:
+            self.packages.path_changed(self.path)
+
+    def do_identity_changed(self, _fd, _err):
+        if self.active:
+            self.packages.path_changed(self.path)
+
+    def close(self):
+        self.watch.close()
 
 
 class Packages:
+    # The packages that go into the checksum (in order) and the hash contexts
+    # to feed them to, until the checksum is first needed.
+    checksum_pending = None
+    _checksum = None
+    digest_cache = None
+    zip_archive = None
+
+    # Installing a package causes a burst of changes, so we reload once
+    # things have been quiet for this long.
+    RELOAD_DELAY = 0.1
+
+    listener = None
+    reload_handle = None
+
     def __init__(self):
-        self.packages = {}
+        self.file_cache = FileCache()
+        self.watches = {}
+        self.changed = set()
         self.load_packages()
 
     def show(self):
@@ -206,7 +760,10 @@ class Packages:
         if self.checksum:
             print(f'checksum = {self.checksum}')
 
-    def try_packages_dir(self, path, checksums):
+    def try_packages_dir(self, path, checksums, walk, reuse):
+        if isinstance(path, Path):
+            self.directories.append(path)
+
         try:
             items = directory_items(path)
         except FileNotFoundError:
@@ -214,10 +771,18 @@ class Packages:
 
         for item in items:
             if item.is_dir():
-                try:
-                    package = Package(item)
-                except FileNotFoundError:
-                    continue
+                if isinstance(item, Path):
+                    self.package_directories.append(item)
+
+                package = reuse.get(item)
+                if package is None:
+                    try:
+                        package = Package(item)
+                    except FileNotFoundError:
+                        continue
+                    except ValueError as exc:
+                        logger.warning('%s: invalid manifest: %s', item, exc)
+                        continue
 
                 if package.name in self.packages:
                     at_least_prio = self.packages[package.name].priority
@@ -226,35 +791,143 @@ class Packages:
 
                 if package.check(at_least_prio):
                     self.packages[package.name] = package
-                    package.walk(checksums)
+                    if checksums:
+                        walk.append(package)
+
+    def load_packages(self, reuse=None):
+        # Package objects (and their caches) get recreated, but ours need to go
+        self.packages = {}
+        self._checksum = None
+        self.__dict__.pop('manifests_js', None)
+
+        # What we looked at, for watching
+        self.directories = []
+        self.package_directories = []
+
+        if reuse is None:
+            reuse = {}
 
-    def load_packages(self):
         checksums = []
+        walk = []
 
         xdg_data_home = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
-        self.try_packages_dir(Path(xdg_data_home) / 'cockpit', checksums)
+        self.try_packages_dir(Path(xdg_data_home) / 'cockpit', checksums, walk, reuse)
 
         # we only checksum the system content if there's no user content
         if not self.packages:
             checksums.append(hashlib.sha256())
 
         if hasattr(__spec__.loader, 'archive'):
-            root = ZipPathPolyfill(zipfile.ZipFile(__spec__.loader.archive, 'r'))
-            self.try_packages_dir(root / 'dist', checksums)
+            # The archive can't change, so it (and its packages) can be kept
+            if self.zip_archive is None:
+                self.zip_archive = ZipArchive(__spec__.loader.archive)
+            self.try_packages_dir(ZipPath(self.zip_archive, 'dist'), checksums, walk, reuse)
 
         xdg_data_dirs = os.environ.get('XDG_DATA_DIRS', '/usr/local/share:/usr/share')
         for xdg_dir in xdg_data_dirs.split(':'):
-            self.try_packages_dir(Path(xdg_dir) / 'cockpit', checksums)
+            self.try_packages_dir(Path(xdg_dir) / 'cockpit', checksums, walk, reuse)
 
-        if checksums:
-            self.checksum = checksums[0].hexdigest()
+        self.checksum_pending = (checksums, walk)
+
+    def reload(self, changed=None):
+        """Reloads the packages
+
+        If changed is given, only packages with their directory in it get
+        rebuilt, and the others keep their caches and checksum data.
+        """
+        if changed is None:
+            reuse = {}
         else:
-            self.checksum = None
+            reuse = {package.path: package for package in self.packages.values() if package.path not in changed}
 
-    def serve_manifests_js(self, channel):
-        channel.http_ok('text/javascript')
+        self.load_packages(reuse)
+
+        if self.listener is not None:
+            self.update_watches()
+            self.listener.packages_loaded()
+
+    def watch(self, listener):
+        """Starts reloading packages on changes, and reporting that to listener"""
+        self.listener = listener
+        self.update_watches()
+
+    def update_watches(self):
+        wanted = {path: True for path in self.directories}
+        wanted.update((path, False) for path in self.package_directories)
+
+        for path in self.watches.keys() - wanted.keys():
+            self.watches.pop(path).close()
+
+        for path in wanted.keys() - self.watches.keys():
+            self.watches[path] = PackagesWatch(self, path, children=wanted[path])
+
+    def path_changed(self, path):
+        logger.debug('package path %s changed', path)
+        self.changed.add(path)
+
+        if self.reload_handle is not None:
+            self.reload_handle.cancel()
+        self.reload_handle = asyncio.get_running_loop().call_later(self.RELOAD_DELAY, self.reload_changed)
+
+    def reload_changed(self):
+        changed, self.changed = self.changed, set()
+        self.reload_handle = None
+        self.reload(changed)
+
+    @property
+    def checksum(self):
+        # Computing the checksum means visiting every file of every package,
+        # which we don't want to do for things like `--bridges`.
+        if self.checksum_pending is not None:
+            checksums, walk = self.checksum_pending
+            self.checksum_pending = None
+
+            # Packages remember their part of the checksum, so after a reload
+            # only the rebuilt ones need to be visited again.
+            pending = [package for package in walk if package.checksum_data is None]
+            if pending:
+                self.update_checksum_data(pending)
+
+            for package in walk:
+                for context in checksums:
+                    context.update(package.checksum_data)
+
+            if checksums:
+                self._checksum = checksums[0].hexdigest()
+
+        return self._checksum
+
+    def update_checksum_data(self, packages):
+        if self.digest_cache is None:
+            self.digest_cache = DigestCache()
+
+        files = {}
+        for package in packages:
+            files[package] = []
+            package.walk(files[package])
+
+        # Files on disk get hashed in parallel.  Files inside of our zipapp
+        # can't change, so they don't go through the cache.
+        on_disk = [item for package_files in files.values() for _, item in package_files if isinstance(item, Path)]
+        digests = dict(zip(on_disk, self.digest_cache.get_digests(on_disk)))
+
+        for package, package_files in files.items():
+            data = []
+            for rel, item in package_files:
+                if isinstance(item, Path):
+                    sha = digests[item]
+                else:
+                    sha = item.archive.digest(item.at)
+                data.append(f'{rel}\0{sha}\0')
+            package.checksum_data = ''.join(data).encode('ascii')
+
+        self.digest_cache.save()
+
+    # This only changes when the set of packages does
+    @functools.cached_property
+    def manifests_js(self):
         manifests = {name: package.manifest for name, package in self.packages.items()}
-        channel.send_data(("""
+        return ("""
             (function (root, data) {
                 if (typeof define === 'function' && define.amd) {
                     define(data);
@@ -265,15 +938,23 @@ class Packages:
                 } else {
                     root.manifests = data;
                 }
-            }(this, """ + json.dumps(manifests) + """))""").encode('ascii'))
+            }(this, """ + json.dumps(manifests) + """))""").encode('ascii')
+
+    def serve_manifests_js(self, channel):
+        channel.http_ok('text/javascript')
+        channel.send_body(self.manifests_js)
 
     def serve_package_file(self, path, channel):
         package, _, package_path = path[1:].partition('/')
-        self.packages[package].serve_file(package_path, channel)
+        if package not in self.packages:
+            channel.http_error(404, 'Not found')
+            return
+        self.packages[package].serve_file(package_path, channel, self.file_cache,
+                                          conditional=self.checksum is None)
 
     def serve_checksum(self, channel):
         channel.http_ok('text/plain')
-        channel.send_data(self.checksum.encode('ascii'))
+        channel.send_body(self.checksum.encode('ascii'))
 
     def serve_file(self, path, channel):
         assert path[0] == '/'
@@ -281,7 +962,9 @@ class Packages:
         if self.checksum is not None:
             channel.push_header('X-Cockpit-Pkg-Checksum', self.checksum)
         else:
-            channel.push_header('Cache-Control', 'no-cache, no-store')
+            # Package files can change at any time, but browsers may keep them
+            # as long as they revalidate them with the ETag first
+            channel.push_header('Cache-Control', 'no-cache')
 
         if path == '/manifests.js':
             self.serve_manifests_js(channel)
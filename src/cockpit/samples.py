@@ -16,11 +16,16 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import collections
+import logging
 import os
+import socket
+import struct
 
-from typing import Dict, List, NamedTuple, Optional, Union
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
 
 
+logger = logging.getLogger(__name__)
+
 USER_HZ = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
 MS_PER_JIFFY = 1000 / (USER_HZ if (USER_HZ > 0) else 100)
 
@@ -190,6 +195,92 @@ class DiskSampler(Sampler):
             samples['disk.all.written'] = all_written_bytes
 
 
+def parse_pressure_total(data: Optional[bytes], kind: bytes) -> Optional[float]:
+    # https://docs.kernel.org/accounting/psi.html
+    #   some avg10=0.00 avg60=0.00 avg300=0.00 total=0
+    #   full avg10=0.00 avg60=0.00 avg300=0.00 total=0
+    # The total is the accumulated stall time, in usecs.
+    if not data:
+        return None
+
+    line = data.find(kind)
+    if line == -1:
+        return None
+
+    start = data.find(b'total=', line)
+    end = data.find(b'\n', start)
+    if start == -1 or end == -1:
+        return None
+
+    try:
+        return int(data[start + len(b'total='):end]) / 1000
+    except ValueError:
+        return None
+
+
+def sum_io_stat(data: Optional[bytes], key: bytes) -> Optional[int]:
+    # io.stat has one line per device:
+    #   8:0 rbytes=90112 wbytes=0 rios=3 wios=0 dbytes=0 dios=0
+    if data is None:
+        return None
+
+    total = 0
+    start = data.find(key)
+    while start != -1:
+        start += len(key)
+        end = start
+        while end < len(data) and data[end] not in b' \n':
+            end += 1
+        try:
+            total += int(data[start:end])
+        except ValueError:
+            pass  # a malformed field: skip it rather than failing the sample
+        start = data.find(key, end)
+
+    return total
+
+
+class PressureSampler(Sampler):
+    descriptions = [
+        SampleDescription('cpu.pressure.some', 'millisec', 'counter', False),
+        SampleDescription('memory.pressure.some', 'millisec', 'counter', False),
+        SampleDescription('memory.pressure.full', 'millisec', 'counter', False),
+        SampleDescription('io.pressure.some', 'millisec', 'counter', False),
+        SampleDescription('io.pressure.full', 'millisec', 'counter', False),
+    ]
+
+    def __init__(self):
+        # We keep these open and re-read them from the start on each sample.
+        self.fds: Dict[str, int] = {}
+        for resource in ['cpu', 'memory', 'io']:
+            try:
+                self.fds[resource] = os.open(f'/proc/pressure/{resource}', os.O_RDONLY)
+            except FileNotFoundError:
+                # kernel without CONFIG_PSI
+                pass
+
+    def __del__(self):
+        for fd in self.fds.values():
+            os.close(fd)
+
+    def sample(self, samples: Samples) -> None:
+        for resource, fd in self.fds.items():
+            try:
+                data = os.pread(fd, 1024, 0)
+            except OSError:
+                # EOPNOTSUPP when booted with psi=0
+                continue
+
+            some = parse_pressure_total(data, b'some')
+            if some is not None:
+                samples[f'{resource}.pressure.some'] = some
+
+            if resource != 'cpu':
+                full = parse_pressure_total(data, b'full')
+                if full is not None:
+                    samples[f'{resource}.pressure.full'] = full
+
+
 class CGroupSampler(Sampler):
     descriptions = [
         SampleDescription('cgroup.memory.usage', 'bytes', 'instant', True),
@@ -198,12 +289,20 @@ class CGroupSampler(Sampler):
         SampleDescription('cgroup.memory.sw-limit', 'bytes', 'instant', True),
         SampleDescription('cgroup.cpu.usage', 'millisec', 'counter', True),
         SampleDescription('cgroup.cpu.shares', 'count', 'instant', True),
+        SampleDescription('cgroup.cpu.pressure.some', 'millisec', 'counter', True),
+        SampleDescription('cgroup.memory.pressure.some', 'millisec', 'counter', True),
+        SampleDescription('cgroup.memory.pressure.full', 'millisec', 'counter', True),
+        SampleDescription('cgroup.io.pressure.some', 'millisec', 'counter', True),
+        SampleDescription('cgroup.io.pressure.full', 'millisec', 'counter', True),
+        SampleDescription('cgroup.io.read', 'bytes', 'counter', True),
+        SampleDescription('cgroup.io.written', 'bytes', 'counter', True),
     ]
 
     cgroups_v2: Optional[bool] = None
+    cgroups_v2_path = '/sys/fs/cgroup/'
 
     @staticmethod
-    def read_cgroup_integer_stat(rootfd: int, statfile: str, include_zero: bool = False, key: bytes = b'') -> Optional[int]:
+    def read_cgroup_file(rootfd: int, statfile: str) -> Optional[bytes]:
         # Not every stat is available, such as cpu.weight
         try:
             fd = os.open(statfile, os.O_RDONLY, dir_fd=rootfd)
@@ -211,10 +310,23 @@ class CGroupSampler(Sampler):
             return None
 
         try:
-            data = os.read(fd, 1024)
+            # io.stat has a line per device, so it can be bigger than a page
+            chunks = []
+            while chunk := os.read(fd, 4096):
+                chunks.append(chunk)
+            return b''.join(chunks)
+        except OSError:
+            # pressure files fail with EOPNOTSUPP if PSI is disabled
+            return None
         finally:
             os.close(fd)
 
+    @staticmethod
+    def read_cgroup_integer_stat(rootfd: int, statfile: str, include_zero: bool = False, key: bytes = b'') -> Optional[int]:
+        data = CGroupSampler.read_cgroup_file(rootfd, statfile)
+        if data is None:
+            return None
+
         if key:
             start = data.index(key) + len(key)
             end = data.index(b'\n', start)
@@ -234,10 +346,10 @@ class CGroupSampler(Sampler):
 
     def sample(self, samples: Samples) -> None:
         if self.cgroups_v2 is None:
-            self.cgroups_v2 = os.path.exists('/sys/fs/cgroup/cgroup.controllers')
+            self.cgroups_v2 = os.path.exists(f'{self.cgroups_v2_path}cgroup.controllers')
 
         if self.cgroups_v2:
-            cgroups_v2_path = '/sys/fs/cgroup/'
+            cgroups_v2_path = self.cgroups_v2_path
             for path, _, _, rootfd in os.fwalk(cgroups_v2_path):
                 cgroup = path.replace(cgroups_v2_path, '')
 
@@ -252,6 +364,23 @@ class CGroupSampler(Sampler):
                 usage_usec = self.read_cgroup_integer_stat(rootfd, 'cpu.stat', True, key=b'usage_usec')
                 if usage_usec:
                     samples['cgroup.cpu.usage'][cgroup] = usage_usec / 1000
+
+                # The pressure files and io.stat only exist on cgroups v2, and
+                # we read them here to avoid walking the tree a second time.
+                # They are counters, so leave out the ones we couldn't read:
+                # the cgroup may be gone, or the controller not enabled.
+                for resource in ['cpu', 'memory', 'io']:
+                    pressure = self.read_cgroup_file(rootfd, f'{resource}.pressure')
+                    for kind in ['some'] if resource == 'cpu' else ['some', 'full']:
+                        total = parse_pressure_total(pressure, kind.encode())
+                        if total is not None:
+                            samples[f'cgroup.{resource}.pressure.{kind}'][cgroup] = total
+
+                io_stat = self.read_cgroup_file(rootfd, 'io.stat')
+                for name, key in [('read', b' rbytes='), ('written', b' wbytes=')]:
+                    io_bytes = sum_io_stat(io_stat, key)
+                    if io_bytes is not None:
+                        samples[f'cgroup.io.{name}'][cgroup] = io_bytes
         else:
             memory_path = '/sys/fs/cgroup/memory/'
             for path, _, _, rootfd in os.fwalk(memory_path):
@@ -282,20 +411,261 @@ class NetworkSampler(Sampler):
     descriptions = [
         SampleDescription('network.interface.tx', 'bytes', 'counter', True),
         SampleDescription('network.interface.rx', 'bytes', 'counter', True),
+        SampleDescription('network.interface.tx-packets', 'count', 'counter', True),
+        SampleDescription('network.interface.rx-packets', 'count', 'counter', True),
+        SampleDescription('network.interface.tx-errors', 'count', 'counter', True),
+        SampleDescription('network.interface.rx-errors', 'count', 'counter', True),
+        SampleDescription('network.interface.tx-dropped', 'count', 'counter', True),
+        SampleDescription('network.interface.rx-dropped', 'count', 'counter', True),
     ]
 
     def sample(self, samples: Samples) -> None:
         with open("/proc/net/dev") as network_samples:
             for line in network_samples:
-                fields = line.split()
-
-                # Skip header line
-                if fields[0][-1] != ':':
+                # Skip header lines.  Long interface names run into the
+                # first number, so split on the colon first.
+                iface, colon, stats = line.partition(':')
+                if not colon:
                     continue
 
-                iface = fields[0][:-1]
-                samples['network.interface.rx'][iface] = int(fields[1])
-                samples['network.interface.tx'][iface] = int(fields[9])
+                iface = iface.strip()
+                fields = stats.split()
+                samples['network.interface.rx'][iface] = int(fields[0])
+                samples['network.interface.rx-packets'][iface] = int(fields[1])
+                samples['network.interface.rx-errors'][iface] = int(fields[2])
+                samples['network.interface.rx-dropped'][iface] = int(fields[3])
+                samples['network.interface.tx'][iface] = int(fields[8])
+                samples['network.interface.tx-packets'][iface] = int(fields[9])
+                samples['network.interface.tx-errors'][iface] = int(fields[10])
+                samples['network.interface.tx-dropped'][iface] = int(fields[11])
+
+
+class NetlinkNetworkSampler(NetworkSampler):
+    """Samples network interface statistics with a RTM_GETSTATS dump
+
+    This gets the statistics for all interfaces in one go, in binary form,
+    which is a lot cheaper than parsing /proc/net/dev on hosts with many
+    interfaces.  If netlink is unavailable for some reason, we fall back to
+    /proc/net/dev.
+
+    The stats dump only contains interface indexes, so we keep a cache of the
+    names, and flush it whenever we get a link change notification.  We don't
+    use a RTM_GETLINK dump for that: it is about a hundred times larger and
+    decoding its attributes costs more than parsing /proc/net/dev.
+    """
+
+    # <linux/netlink.h>, <linux/rtnetlink.h>, <linux/if_link.h>
+    NLMSG_ERROR = 2
+    NLMSG_DONE = 3
+    NLM_F_REQUEST = 0x1
+    NLM_F_DUMP = 0x300
+    RTM_GETSTATS = 94
+    RTMGRP_LINK = 0x1
+    IFLA_STATS_LINK_64 = 1
+
+    NLMSGHDR = struct.Struct('=IHHII')    # len, type, flags, seq, pid
+    IF_STATS_MSG = struct.Struct('=BxxxII')  # family, ifindex, filter_mask
+    RTATTR = struct.Struct('=HH')         # len, type
+    # rx_packets, tx_packets, rx_bytes, tx_bytes, rx_errors, tx_errors, rx_dropped, tx_dropped, ...
+    RTNL_LINK_STATS64 = struct.Struct('=8Q')
+
+    sock: Optional[socket.socket] = None
+    monitor: Optional[socket.socket] = None
+    seq: int = 0
+
+    def __init__(self):
+        self.names: Dict[int, Optional[str]] = {}
+        try:
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_CLOEXEC, socket.NETLINK_ROUTE)
+            self.sock.bind((0, 0))
+            self.monitor = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_CLOEXEC | socket.SOCK_NONBLOCK,
+                                         socket.NETLINK_ROUTE)
+            self.monitor.bind((0, self.RTMGRP_LINK))
+        except OSError as exc:
+            logger.debug('netlink unavailable, using /proc/net/dev: %s', exc)
+            self.close_sockets()
+
+    def __del__(self):
+        self.close_sockets()
+
+    def close_sockets(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.monitor is not None:
+            self.monitor.close()
+            self.monitor = None
+
+    def links_changed(self) -> bool:
+        assert self.monitor is not None
+        changed = False
+        while True:
+            try:
+                changed |= bool(self.monitor.recv(65536))
+            except BlockingIOError:
+                return changed
+            except OSError:
+                # ENOBUFS: we missed some notifications
+                changed = True
+
+    def get_name(self, ifindex: int) -> Optional[str]:
+        try:
+            return self.names[ifindex]
+        except KeyError:
+            pass
+
+        try:
+            name = socket.if_indextoname(ifindex)
+        except OSError:
+            # went away in the meantime
+            name = None
+
+        self.names[ifindex] = name
+        return name
+
+    def request_stats(self) -> List[bytes]:
+        assert self.sock is not None
+        self.seq += 1
+        header = self.NLMSGHDR.pack(self.NLMSGHDR.size + self.IF_STATS_MSG.size, self.RTM_GETSTATS,
+                                    self.NLM_F_REQUEST | self.NLM_F_DUMP, self.seq, 0)
+        self.sock.send(header + self.IF_STATS_MSG.pack(socket.AF_UNSPEC, 0, 1 << (self.IFLA_STATS_LINK_64 - 1)))
+
+        messages: List[bytes] = []
+        while True:
+            data = self.sock.recv(65536)
+            offset = 0
+            while offset < len(data):
+                length, msg_type, _, seq, _ = self.NLMSGHDR.unpack_from(data, offset)
+                if length < self.NLMSGHDR.size:
+                    raise OSError('invalid netlink message')
+                if seq == self.seq:
+                    if msg_type == self.NLMSG_DONE:
+                        return messages
+                    elif msg_type == self.NLMSG_ERROR:
+                        error, = struct.unpack_from('=i', data, offset + self.NLMSGHDR.size)
+                        raise OSError(-error, 'netlink stats dump failed')
+                    messages.append(data[offset:offset + length])
+                offset += (length + 3) & ~3
+
+    def sample(self, samples: Samples) -> None:
+        if self.sock is None:
+            super().sample(samples)
+            return
+
+        try:
+            if self.links_changed():
+                self.names.clear()
+            messages = self.request_stats()
+        except OSError as exc:
+            # EINVAL: kernel older than 4.7, which doesn't know RTM_GETSTATS
+            logger.debug('netlink stats dump failed, using /proc/net/dev: %s', exc)
+            self.close_sockets()
+            super().sample(samples)
+            return
+
+        # Each message is a if_stats_msg with a single IFLA_STATS_LINK_64 attribute
+        attr = self.NLMSGHDR.size + self.IF_STATS_MSG.size
+        for message in messages:
+            _, ifindex, _ = self.IF_STATS_MSG.unpack_from(message, self.NLMSGHDR.size)
+            attr_len, attr_type = self.RTATTR.unpack_from(message, attr)
+            if attr_type != self.IFLA_STATS_LINK_64 or attr_len < self.RTATTR.size + self.RTNL_LINK_STATS64.size:
+                continue
+
+            iface = self.get_name(ifindex)
+            if iface is None:
+                continue
+
+            (rx_packets, tx_packets, rx_bytes, tx_bytes,
+             rx_errors, tx_errors, rx_dropped, tx_dropped) = self.RTNL_LINK_STATS64.unpack_from(message, attr + self.RTATTR.size)
+            samples['network.interface.rx'][iface] = rx_bytes
+            samples['network.interface.rx-packets'][iface] = rx_packets
+            samples['network.interface.rx-errors'][iface] = rx_errors
+            samples['network.interface.rx-dropped'][iface] = rx_dropped
+            samples['network.interface.tx'][iface] = tx_bytes
+            samples['network.interface.tx-packets'][iface] = tx_packets
+            samples['network.interface.tx-errors'][iface] = tx_errors
+            samples['network.interface.tx-dropped'][iface] = tx_dropped
+
+
+class ProcessSampler(Sampler):
+    descriptions = [
+        SampleDescription('process.cpu', 'millisec', 'counter', True),
+        SampleDescription('process.rss', 'bytes', 'instant', True),
+        SampleDescription('process.vsize', 'bytes', 'instant', True),
+        SampleDescription('process.threads', 'count', 'instant', True),
+    ]
+
+    # Only the busiest processes get sent: anything more is too much data for
+    # a "top processes" view, and the instance list would change constantly.
+    top = 20
+
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+    procfd: int = -1
+
+    def __init__(self):
+        # pid → (starttime, cpu ticks) as of the previous sample
+        self.last: Dict[int, Tuple[int, int]] = {}
+        self.procfd = os.open('/proc', os.O_RDONLY | os.O_DIRECTORY)
+
+    def __del__(self):
+        if self.procfd != -1:
+            os.close(self.procfd)
+
+    def read_file(self, path: str) -> bytes:
+        fd = os.open(path, os.O_RDONLY, dir_fd=self.procfd)
+        try:
+            return os.read(fd, 4096)
+        finally:
+            os.close(fd)
+
+    def sample(self, samples: Samples) -> None:
+        current = {}
+        candidates = []
+
+        for name in os.listdir(self.procfd):
+            if not name.isdigit():
+                continue
+
+            try:
+                stat = self.read_file(f'{name}/stat')
+                statm = self.read_file(f'{name}/statm')
+            except OSError:
+                # the process exited while we were looking at it
+                continue
+
+            # The command name is in parens and can contain anything, including
+            # spaces and parens.  Everything after the last ')' is well-behaved.
+            # https://man7.org/linux/man-pages/man5/proc.5.html
+            open_paren = stat.find(b'(')
+            close_paren = stat.rfind(b')')
+            if open_paren == -1 or close_paren == -1:
+                continue
+            comm = stat[open_paren + 1:close_paren].decode('utf-8', errors='replace')
+            fields = stat[close_paren + 2:].split()
+            utime, stime, threads, starttime = int(fields[11]), int(fields[12]), int(fields[17]), int(fields[19])
+            statm_size, statm_resident = statm.split(maxsplit=2)[:2]
+
+            pid = int(name)
+            ticks = utime + stime
+            current[pid] = (starttime, ticks)
+
+            # Compare against the previous sample to find the busiest
+            # processes.  New processes (including re-used pids) are ranked on
+            # all of the CPU time they used so far.
+            last_starttime, last_ticks = self.last.get(pid, (starttime, 0))
+            delta = ticks - last_ticks if last_starttime == starttime else ticks
+
+            candidates.append((delta, f'{pid}:{comm}', ticks, int(statm_resident), int(statm_size), threads))
+
+        self.last = current
+
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        for _, instance, ticks, resident, size, threads in candidates[:self.top]:
+            samples['process.cpu'][instance] = ticks * MS_PER_JIFFY
+            samples['process.rss'][instance] = resident * self.PAGE_SIZE
+            samples['process.vsize'][instance] = size * self.PAGE_SIZE
+            samples['process.threads'][instance] = threads
 
 
 class MountSampler(Sampler):
@@ -344,5 +714,7 @@ SAMPLERS = [
     DiskSampler,
     MemorySampler,
     MountSampler,
-    NetworkSampler,
+    NetlinkNetworkSampler,
+    PressureSampler,
+    ProcessSampler,
 ]
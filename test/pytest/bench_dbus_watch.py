@@ -0,0 +1,201 @@
+# This file is part of Cockpit.
+#
+# Copyright (C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measures how long a dbus-json3 watch of a big ObjectManager takes
+
+This starts a private dbus-daemon, and a service on it which exports a number
+of objects below an ObjectManager at /bench.  Then it sends a watch for the
+/bench path namespace to cockpit-bridge, and measures the time until the
+reply.  That's done with a new bridge each time, and once more on a second
+channel of the same bridge, where the introspection data is already cached.
+
+The service uses Gio, so it needs PyGObject.  If the Python that runs the
+bridge doesn't have it, give another one with --service-python.
+
+    python3 test/pytest/bench_dbus_watch.py [--objects N] [--interfaces N] [--runs N]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from typing import Any, Dict, List, Set, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, '..', '..', 'src')
+
+BUS_NAME = 'org.cockpit.Bench'
+ROOT = '/bench'
+
+
+def serve(n_objects: int, n_interfaces: int) -> None:
+    from gi.repository import Gio, GLib  # type: ignore[import]
+
+    interface_names = [f'org.cockpit.Bench.Iface{i}' for i in range(n_interfaces)]
+    node_info = Gio.DBusNodeInfo.new_for_xml('<node>' + ''.join(f'''
+        <interface name="{name}">
+          <method name="Ping"><arg type="s" direction="out"/></method>
+          <property name="Value" type="s" access="read"/>
+          <property name="Index" type="u" access="read"/>
+        </interface>''' for name in interface_names) + '''
+        <interface name="org.freedesktop.DBus.ObjectManager">
+          <method name="GetManagedObjects"><arg type="a{oa{sa{sv}}}" direction="out"/></method>
+          <signal name="InterfacesAdded"><arg type="o"/><arg type="a{sa{sv}}"/></signal>
+          <signal name="InterfacesRemoved"><arg type="o"/><arg type="as"/></signal>
+        </interface>
+    </node>''')
+    objects = {f'{ROOT}/obj{i}': interface_names[i % n_interfaces] for i in range(n_objects)}
+
+    def properties(path: str) -> Dict[str, GLib.Variant]:
+        index = int(path.rpartition('obj')[2])
+        return {'Value': GLib.Variant('s', f'object {index}'), 'Index': GLib.Variant('u', index)}
+
+    def get_property(_connection, _sender, path, _interface, name):
+        return properties(path)[name]
+
+    def method_call(_connection, _sender, path, _interface, method, _params, invocation):
+        if method == 'GetManagedObjects':
+            managed = {path: {name: properties(path)} for path, name in objects.items()}
+            invocation.return_value(GLib.Variant('(a{oa{sa{sv}}})', (managed,)))
+        else:
+            invocation.return_value(GLib.Variant('(s)', (path,)))
+
+    connection = Gio.bus_get_sync(Gio.BusType.SESSION)
+    connection.register_object(ROOT, node_info.lookup_interface('org.freedesktop.DBus.ObjectManager'),
+                               method_call, None, None)
+    for path, name in objects.items():
+        connection.register_object(path, node_info.lookup_interface(name), method_call, get_property, None)
+
+    connection.call_sync('org.freedesktop.DBus', '/org/freedesktop/DBus', 'org.freedesktop.DBus', 'RequestName',
+                         GLib.Variant('(su)', (BUS_NAME, 4)), None, Gio.DBusCallFlags.NONE, -1)
+    print('ready', flush=True)
+    GLib.MainLoop().run()
+
+
+class Bridge:
+    def __init__(self, env: Dict[str, str]):
+        self.process = subprocess.Popen([sys.executable, '-m', 'cockpit.bridge'],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        self.next_id = 0
+        self.expect('', 'init')
+        self.send('', command='init', version=1, host='localhost')
+
+    def send(self, _channel: str, **kwargs) -> None:
+        assert self.process.stdin is not None
+        frame = _channel.encode('ascii') + b'\n' + json.dumps(kwargs).encode('ascii')
+        self.process.stdin.write(str(len(frame)).encode('ascii') + b'\n' + frame)
+        self.process.stdin.flush()
+
+    def receive(self) -> Tuple[str, Dict[str, Any]]:
+        assert self.process.stdout is not None
+        length = self.process.stdout.readline()
+        if not length:
+            sys.exit('cockpit-bridge exited unexpectedly')
+        channel, _, data = self.process.stdout.read(int(length)).partition(b'\n')
+        return channel.decode('ascii'), json.loads(data)
+
+    def expect(self, channel: str, command: str) -> None:
+        while True:
+            got_channel, message = self.receive()
+            if got_channel == channel and message.get('command') == command:
+                return
+            if message.get('command') == 'close':
+                sys.exit(f'unexpected close: {message}')
+
+    def time_watch(self) -> Tuple[float, int]:
+        self.next_id += 1
+        channel = f'bench.{self.next_id}'
+        self.send('', command='open', channel=channel, payload='dbus-json3', bus='session', name=BUS_NAME)
+        self.expect('', 'ready')
+
+        start = time.monotonic()
+        self.send(channel, watch={'path_namespace': ROOT}, id='watch')
+        objects: Set[str] = set()
+        while True:
+            got_channel, message = self.receive()
+            if got_channel != channel:
+                continue
+            if 'notify' in message:
+                objects.update(message['notify'])
+            elif message.get('id') == 'watch':
+                assert 'reply' in message, message
+                elapsed = time.monotonic() - start
+                break
+
+        self.send('', command='close', channel=channel)
+        return elapsed, len(objects)
+
+    def close(self) -> None:
+        assert self.process.stdin is not None
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Time a dbus-json3 watch of a big ObjectManager')
+    parser.add_argument('--objects', type=int, default=1000, help='Number of objects to export')
+    parser.add_argument('--interfaces', type=int, default=10, help='Number of distinct interfaces')
+    parser.add_argument('--runs', type=int, default=5, help='Report the best of this many runs')
+    parser.add_argument('--service-python', default=sys.executable, help='Python with PyGObject for the service')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.objects, args.interfaces)
+        return
+
+    daemon = subprocess.Popen(['dbus-daemon', '--session', '--nofork', '--print-address'],
+                              stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        assert daemon.stdout is not None
+        env = dict(os.environ, DBUS_SESSION_BUS_ADDRESS=daemon.stdout.readline().strip(),
+                   PYTHONPATH=os.path.abspath(SRC))
+
+        service = subprocess.Popen([args.service_python, __file__, '--serve',
+                                    f'--objects={args.objects}', f'--interfaces={args.interfaces}'],
+                                   stdout=subprocess.PIPE, env=env, universal_newlines=True)
+        try:
+            assert service.stdout is not None
+            if service.stdout.readline().strip() != 'ready':
+                sys.exit('the test service failed to start')
+
+            first: List[float] = []
+            repeated: List[float] = []
+            for _ in range(args.runs):
+                bridge = Bridge(env)
+                elapsed, n_objects = bridge.time_watch()
+                assert n_objects >= args.objects, n_objects
+                first.append(elapsed)
+                repeated.append(bridge.time_watch()[0])
+                bridge.close()
+
+            print(f'{args.objects} objects with {args.interfaces} interfaces, best of {args.runs}:')
+            print(f'  first watch    {min(first) * 1000:6.0f} ms')
+            print(f'  repeated watch {min(repeated) * 1000:6.0f} ms')
+        finally:
+            service.terminate()
+            service.wait()
+    finally:
+        daemon.terminate()
+        daemon.wait()
+
+
+if __name__ == '__main__':
+    main()
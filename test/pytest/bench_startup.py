@@ -0,0 +1,112 @@
+# This file is part of Cockpit.
+#
+# Copyright (C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measures the time from spawning cockpit-bridge to its init message
+
+The bridge runs behind pseudo.py, like the superuser bridge in the tests,
+against a generated set of packages in a temporary directory.  It's started
+as a normal bridge with a cold and with a warm digest cache, and with
+--privileged, which skips the checksum.
+
+    python3 test/pytest/bench_startup.py [--packages N] [--files N] [--runs N]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PSEUDO = os.path.join(HERE, 'pseudo.py')
+SRC = os.path.join(HERE, '..', '..', 'src')
+
+
+def make_packages(datadir: str, n_packages: int, n_files: int) -> None:
+    for i in range(n_packages):
+        path = os.path.join(datadir, 'cockpit', f'package{i}')
+        os.makedirs(path)
+        with open(os.path.join(path, 'manifest.json'), 'w') as file:
+            json.dump({'menu': {'index': {'label': f'Package {i}'}}}, file)
+        for j in range(n_files):
+            with open(os.path.join(path, f'file{j}.js'), 'w') as file:
+                file.write(f'/* package {i}, file {j} */\n' * 2000)
+
+
+def read_frame(stream) -> bytes:
+    length = stream.readline()
+    if not length:
+        sys.exit('cockpit-bridge exited before sending init')
+    return stream.read(int(length))
+
+
+def time_to_init(args: List[str], env: Dict[str, str]) -> float:
+    start = time.monotonic()
+    with subprocess.Popen([sys.executable, PSEUDO, sys.executable, '-m', 'cockpit.bridge', *args],
+                          stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env) as bridge:
+        assert bridge.stdout is not None and bridge.stdin is not None
+        while True:
+            channel, _, data = read_frame(bridge.stdout).partition(b'\n')
+            if channel == b'' and json.loads(data).get('command') == 'init':
+                elapsed = time.monotonic() - start
+                break
+        bridge.stdin.close()
+        bridge.wait()
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Time cockpit-bridge startup up to the init message')
+    parser.add_argument('--packages', type=int, default=50, help='Number of packages to generate')
+    parser.add_argument('--files', type=int, default=20, help='Number of files per package')
+    parser.add_argument('--runs', type=int, default=5, help='Report the best of this many runs')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        make_packages(os.path.join(tmpdir, 'share'), args.packages, args.files)
+        cachedir = os.path.join(tmpdir, 'cache')
+
+        env = dict(os.environ, PYTHONPATH=os.path.abspath(SRC),
+                   XDG_DATA_DIRS=os.path.join(tmpdir, 'share'),
+                   XDG_DATA_HOME=os.path.join(tmpdir, 'home'),
+                   XDG_CACHE_HOME=cachedir)
+        env.pop('XDG_RUNTIME_DIR', None)
+
+        def cold(bridge_args: List[str]) -> float:
+            shutil.rmtree(cachedir, ignore_errors=True)
+            return time_to_init(bridge_args, env)
+
+        def warm(bridge_args: List[str]) -> float:
+            return time_to_init(bridge_args, env)
+
+        print(f'{args.packages} packages of {args.files} files, best of {args.runs}:')
+        for label, run, bridge_args in [
+            ('checksum, cold digest cache', cold, []),
+            ('checksum, warm digest cache', warm, []),
+            ('--privileged, no checksum', cold, ['--privileged']),
+        ]:
+            best = min(run(bridge_args) for _ in range(args.runs))
+            print(f'  {label:30} {best * 1000:6.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
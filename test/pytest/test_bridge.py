@@ -2,13 +2,16 @@ import argparse
 import asyncio
 import json
 import os
+import pstats
+import tempfile
+import time
 import unittest
 import sys
 
 from typing import Any, Dict, Iterable, Optional, Tuple
 
 import systemd_ctypes
-from cockpit.bridge import Bridge
+from cockpit.bridge import Bridge, StartupTrace, parse_os_release
 import cockpit.superuser
 
 MOCK_HOSTNAME = 'mockbox'
@@ -267,6 +270,161 @@ class TestBridge(unittest.IsolatedAsyncioTestCase):
         assert 'notify' in notify
         assert notify['notify']['/foo'] == {'test.iface': {'Prop': 'xyz'}}
 
+    async def test_dbus_interface_cache(self):
+        await self.start()
+
+        my_object = test_iface()
+        self.bridge.internal_bus.export('/foo', my_object)
+
+        # Two channels watching the same object share one introspection
+        channels = [await self.transport.check_open('dbus-json3', bus='internal') for _ in range(2)]
+        for channel in channels:
+            await self.transport.watch_bus('/foo', 'test.iface', {'Prop': 'none'}, bus=channel)
+
+        cache = self.bridge.open_channels[channels[0]].cache
+        assert self.bridge.open_channels[channels[1]].cache is cache
+        assert cache.introspections == 1
+
+        # Watches of a whole object need all of its current interfaces, so
+        # those introspect every time
+        self.bridge.internal_bus.export('/bar', test_iface())
+        for channel in channels:
+            tag = self.transport.get_id('watch')
+            self.transport.send_json(channel, watch={'path': '/bar'}, id=tag)
+            await self.transport.assert_bus_meta('/bar', 'test.iface', ['Prop'], bus=channel)
+            await self.transport.assert_bus_notify('/bar', 'test.iface', {'Prop': 'none'}, bus=channel)
+            await self.transport.assert_msg(channel, id=tag, reply=[])
+        assert cache.introspections == 3
+
+    async def test_dbus_gather_calls(self):
+        await self.start()
+
+        internal = await self.transport.ensure_internal_bus()
+        channel = self.bridge.open_channels[internal]
+
+        # Calls run concurrently, up to the limit, and results come in order
+        running = peak = 0
+
+        async def call(n):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep((n * 7 % 10) / 1000)  # finish out of order
+            running -= 1
+            return n
+
+        count = channel.MAX_CONCURRENT_CALLS * 3
+        assert await channel.gather_calls(call(n) for n in range(count)) == list(range(count))
+        assert peak == channel.MAX_CONCURRENT_CALLS
+
+        # The same for real calls, to many objects
+        for n in range(100):
+            my_object = test_iface()
+            my_object.prop = f'value {n}'
+            self.bridge.internal_bus.export(f'/objects/{n}', my_object)
+
+        async def get_all(n):
+            props, = await channel.bus.call_method_async(None, f'/objects/{n}', 'org.freedesktop.DBus.Properties',
+                                                         'GetAll', 's', 'test.iface')
+            return props['Prop']['v']
+
+        assert await channel.gather_calls(get_all(n) for n in range(100)) == [f'value {n}' for n in range(100)]
+
+    async def test_dbus_channel_ordering(self):
+        await self.start()
+
+        my_object = test_iface()
+        self.bridge.internal_bus.export('/foo', my_object)
+
+        stalled = await self.transport.check_open('dbus-json3', bus='internal')
+        other = await self.transport.check_open('dbus-json3', bus='internal')
+
+        # Stall the setup of a watch on one channel
+        release = asyncio.Event()
+        channel = self.bridge.open_channels[stalled]
+        setup_path_watch = channel.setup_path_watch
+
+        async def stalled_setup_path_watch(*args):
+            await release.wait()
+            await setup_path_watch(*args)
+        channel.setup_path_watch = stalled_setup_path_watch
+
+        self.transport.send_json(stalled, watch={'path': '/foo', 'interface': 'test.iface'}, id='watch')
+        get = self.transport.send_bus_call(stalled, '/foo', 'org.freedesktop.DBus.Properties', 'Get',
+                                           ['test.iface', 'Prop'])
+
+        # The other channel doesn't have to wait for it
+        start = time.monotonic()
+        await asyncio.wait_for(self.transport.check_bus_call('/foo', 'org.freedesktop.DBus.Properties', 'Get',
+                                                             ['test.iface', 'Prop'], bus=other), 1)
+        assert time.monotonic() - start < 0.5
+
+        # ... but on the stalled channel, the method reply waits for the watch
+        release.set()
+        await self.transport.assert_bus_meta('/foo', 'test.iface', ['Prop'], bus=stalled)
+        await self.transport.assert_bus_notify('/foo', 'test.iface', {'Prop': 'none'}, bus=stalled)
+        await self.transport.assert_msg(stalled, id='watch', reply=[])
+        await self.transport.assert_bus_reply(get, bus=stalled)
+
+    async def test_dbus_notify_coalescing(self):
+        await self.start()
+
+        my_object = test_iface()
+        self.bridge.internal_bus.export('/foo', my_object)
+        internal = await self.transport.ensure_internal_bus()
+        await self.transport.watch_bus('/foo', 'test.iface', {'Prop': 'none'})
+
+        # A burst of changes within one loop iteration becomes one message
+        channel = self.bridge.open_channels[internal]
+        for value in ['a', 'b', 'c']:
+            channel.send_ordered(notify={'/foo': {'test.iface': {'Prop': value}}})
+        channel.send_ordered(notify={'/bar': {'test.iface': None}})
+        await self.transport.assert_msg(internal, notify={'/foo': {'test.iface': {'Prop': 'c'}},
+                                                          '/bar': {'test.iface': None}})
+
+        # Coalescing never moves a notify past a method reply
+        channel.send_ordered(notify={'/foo': {'test.iface': {'Prop': 'd'}}})
+        channel.send_ordered(reply=[], id='x')
+        channel.send_ordered(notify={'/foo': {'test.iface': {'Prop': 'e'}}})
+        await self.transport.assert_msg(internal, notify={'/foo': {'test.iface': {'Prop': 'd'}}})
+        await self.transport.assert_msg(internal, reply=[], id='x')
+        await self.transport.assert_msg(internal, notify={'/foo': {'test.iface': {'Prop': 'e'}}})
+
+        # ... and never hides the removal of an interface that comes back
+        channel.send_ordered(notify={'/foo': {'test.iface': None}})
+        channel.send_ordered(notify={'/foo': {'test.iface': {'Prop': 'f'}}})
+        channel.send_ordered(notify={'/foo': {'test.iface': {'Prop': 'g'}}})
+        await self.transport.assert_msg(internal, notify={'/foo': {'test.iface': None}})
+        await self.transport.assert_msg(internal, notify={'/foo': {'test.iface': {'Prop': 'g'}}})
+
+    async def test_dbus_shared_matches(self):
+        await self.start()
+
+        my_object = test_iface()
+        self.bridge.internal_bus.export('/foo', my_object)
+
+        channels = [await self.transport.check_open('dbus-json3', bus='internal') for _ in range(2)]
+        for channel in channels:
+            await self.transport.add_bus_match('/foo', 'test.iface', bus=channel)
+
+        # One rule on the bus, and each signal is fanned out to both channels
+        registry = self.bridge.open_channels[channels[0]].match_registry
+        assert len(registry.rules) == 1
+        my_object.sig('hello')
+        frames = [await self.transport.next_frame() for _ in channels]
+        assert sorted(channel for channel, _ in frames) == sorted(channels)
+        for _, data in frames:
+            assert json.loads(data)['signal'] == ['/foo', 'test.iface', 'Sig', ['hello']]
+        assert registry.delivered == 1
+
+        # The rule goes away with the last channel using it
+        self.transport.send_close(channels[0])
+        await asyncio.sleep(0.1)
+        assert len(registry.rules) == 1
+        self.transport.send_close(channels[1])
+        await asyncio.sleep(0.1)
+        assert len(registry.rules) == 0
+
     async def verify_root_bridge_not_running(self):
         assert self.bridge.superuser_rule.peer is None
         await self.transport.assert_bus_props('/superuser', 'cockpit.Superuser',
@@ -352,6 +510,11 @@ class TestBridge(unittest.IsolatedAsyncioTestCase):
 
         await self.verify_root_bridge_running()
 
+    async def test_privileged_init(self):
+        # the privileged bridge doesn't serve packages: it skips the checksum
+        await self.start(argparse.Namespace(privileged=True), send_init=False)
+        await self.transport.assert_msg('', command='init', checksum=None)
+
     async def test_superuser_init_pw(self):
         await self.start(send_init=False)
 
@@ -387,3 +550,114 @@ class TestBridge(unittest.IsolatedAsyncioTestCase):
             # idempotency
             await self.transport.check_bus_call('/LoginMessages', 'cockpit.LoginMessages', 'Dismiss', [], [])
             await self.transport.check_bus_call('/LoginMessages', 'cockpit.LoginMessages', 'Get', [], ["{}"])
+
+    async def test_packages_stream(self):
+        content = os.urandom(300 * 1024)
+        with tempfile.TemporaryDirectory() as datadir:
+            os.makedirs(f'{datadir}/cockpit/test')
+            with open(f'{datadir}/cockpit/test/manifest.json', 'w') as file:
+                file.write('{}')
+            with open(f'{datadir}/cockpit/test/big.js', 'wb') as file:
+                file.write(content)
+
+            with unittest.mock.patch.dict(os.environ, {'XDG_DATA_HOME': datadir}):
+                await self.start()
+
+            headers = {'X-Forwarded-Proto': 'https', 'X-Forwarded-Host': 'localhost'}
+            ch = await self.transport.check_open('http-stream1', internal='packages', method='GET',
+                                                 path='/test/big.js', headers=headers)
+            self.transport.send_done(ch)
+            await self.transport.assert_msg(ch, status=200)
+
+            # the body arrives in several blocks
+            data = b''
+            blocks = 0
+            while len(data) < len(content):
+                channel, block = await self.transport.next_frame()
+                assert channel == ch
+                data += block
+                blocks += 1
+            assert data == content
+            assert blocks > 1
+
+            await self.transport.assert_msg('', command='done', channel=ch)
+            await self.transport.assert_msg('', command='close', channel=ch)
+
+    async def test_packages_reload(self):
+        with tempfile.TemporaryDirectory() as datadir:
+            os.makedirs(f'{datadir}/cockpit')
+            with unittest.mock.patch.dict(os.environ, {'XDG_DATA_HOME': datadir}):
+                await self.start()
+
+            headers = {'X-Forwarded-Proto': 'https', 'X-Forwarded-Host': 'localhost'}
+            ch = await self.transport.check_open('http-stream1', internal='packages', method='GET',
+                                                 path='/hot/hot.js', headers=headers)
+            self.transport.send_done(ch)
+            await self.transport.assert_msg(ch, status=404)
+
+            # install a package, without restarting the bridge
+            os.makedirs(f'{datadir}/cockpit/hot')
+            with open(f'{datadir}/cockpit/hot/manifest.json', 'w') as file:
+                file.write('{"priority": 7}')
+            with open(f'{datadir}/cockpit/hot/hot.js', 'w') as file:
+                file.write('hot')
+
+            for _ in range(100):
+                if 'hot' in self.bridge.packages.packages:
+                    break
+                await asyncio.sleep(0.05)
+
+            ch = await self.transport.check_open('http-stream1', internal='packages', method='GET',
+                                                 path='/hot/hot.js', headers=headers)
+            self.transport.send_done(ch)
+            await self.transport.assert_msg(ch, status=200)
+            await self.transport.assert_data(ch, b'hot')
+
+            manifests, = await self.transport.check_bus_call('/packages', 'org.freedesktop.DBus.Properties',
+                                                             'Get', ['cockpit.Packages', 'Manifests'])
+            assert json.loads(manifests['v'])['hot'] == {'priority': 7}
+
+    async def test_startup_trace(self):
+        await self.start()
+
+        phases, = await self.transport.check_bus_call('/startup', 'org.freedesktop.DBus.Properties',
+                                                      'Get', ['cockpit.Startup', 'Phases'])
+        timestamps = phases['v']
+        assert list(timestamps) == ['main', 'internal-bus', 'packages', 'superuser', 'routing',
+                                    'checksum', 'os-release', 'init']
+        assert list(timestamps.values()) == sorted(timestamps.values())
+
+    async def test_startup_profile(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = f'{tmpdir}/startup.prof'
+            self.bridge = Bridge(argparse.Namespace(privileged=False), StartupTrace(filename))
+            self.transport = MockTransport(self.bridge)
+            await self.transport.assert_msg('', command='init')
+
+            stats = pstats.Stats(filename)
+            assert any(func[2] == 'do_send_init' for func in stats.stats)
+
+
+def test_parse_os_release():
+    assert parse_os_release("""
+# a comment
+NAME=Fedora
+VERSION="38 (Workstation Edition)"
+PRETTY_NAME="Fedora \\"Linux\\" 38"
+CPE_NAME='cpe:/o:fedoraproject:fedora:38'
+SUPPORT_END=
+HOME_URL="https://example.com/a\\nb"
+DOCUMENTATION_URL="\\$HOME \\`x\\` \\\\"
+VARIANT=Work\\ Station
+LOGO='a\\"b'
+""") == {
+        'NAME': 'Fedora',
+        'VERSION': '38 (Workstation Edition)',
+        'PRETTY_NAME': 'Fedora "Linux" 38',
+        'CPE_NAME': 'cpe:/o:fedoraproject:fedora:38',
+        'SUPPORT_END': '',
+        'HOME_URL': 'https://example.com/a\\nb',
+        'DOCUMENTATION_URL': '$HOME `x` \\',
+        'VARIANT': 'Work Station',
+        'LOGO': 'a\\"b',
+    }
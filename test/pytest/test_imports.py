@@ -0,0 +1,69 @@
+# This file is part of Cockpit.
+#
+# Copyright (C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import subprocess
+import sys
+
+from typing import Dict
+
+import pytest
+
+# Modules which are expensive to import, and which the bridge doesn't need
+# before it sends its init message
+NOT_ON_STARTUP = [
+    'cProfile',
+    'cockpit.channels.dbus',
+    'cockpit.channels.http',
+    'cockpit.channels.metrics',
+    'http.client',
+    'pkg_resources',
+    'xml.etree.ElementTree',
+]
+
+# Cumulative import time, in microseconds.  This is generous, so that slow
+# machines pass, but it catches something like pkg_resources sneaking back.
+BUDGET = 400_000
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """Imports module in a new interpreter, and returns the cumulative time of all imports"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            env=dict(os.environ, PYTHONPATH=':'.join(sys.path)),
+                            stderr=subprocess.PIPE, check=True, universal_newlines=True)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:'):
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():  # not the header
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize('module', ['cockpit.packages', 'cockpit.channels', 'cockpit.bridge'])
+def test_import_budget(module):
+    if module == 'cockpit.bridge':
+        pytest.importorskip('systemd_ctypes')
+
+    times = import_times(module)
+    assert module in times
+
+    for name in NOT_ON_STARTUP:
+        assert name not in times, f'{module} imports {name}'
+
+    assert times[module] < BUDGET, f'importing {module} took {times[module]}us'
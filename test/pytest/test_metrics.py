@@ -0,0 +1,93 @@
+# This file is part of Cockpit.
+#
+# Copyright (C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import json
+import math
+import struct
+
+from cockpit.channels.metrics import InternalMetricsChannel
+
+
+class MockMetricsChannel(InternalMetricsChannel):
+    # Just enough of a channel to feed it samples and look at what it sends
+    def __init__(self, **options):
+        self.metrics = []
+        self.instances = []
+        self.messages = []
+        self.ensure_samplers()
+        self.parse_options(dict(options, metrics=[{'name': 'memory.used'}, {'name': 'cgroup.memory.usage'}]))
+
+    def send_message(self, **kwargs):
+        self.messages.append(kwargs)
+
+    def send_data(self, data):
+        self.messages.append(json.loads(data))
+
+    def update(self, instances):
+        samples = collections.defaultdict(dict, {'memory.used': 100, 'cgroup.memory.usage': instances})
+        self.messages = []
+        self.send_updates(samples, collections.defaultdict(dict))
+        return self.messages
+
+
+def test_float64_encoding():
+    # a missing non-instanced metric is sampled as {}, and becomes NaN
+    data = InternalMetricsChannel.encode_float64([1.5, {}, None, [2, None, False]])
+    version, count = struct.unpack_from('<II', data)
+    assert (version, count) == (1, 6)
+
+    values = struct.unpack_from('<6d', data, 8)
+    assert values[0] == 1.5
+    assert values[3] == 2
+    assert all(math.isnan(values[i]) for i in (1, 2, 4, 5))
+
+
+def test_delta_meta():
+    channel = MockMetricsChannel(**{'delta-meta': True})
+
+    # the first meta message is always complete
+    meta, data = channel.update({'a': 1, 'b': 2})
+    assert 'delta' not in meta
+    assert meta['metrics'][1]['instances'] == ['a', 'b']
+    assert data == [[100, [1, 2]]]
+
+    # without changes to the instances, there's no meta
+    assert channel.update({'b': 2, 'a': 1}) == [[[100, [1, 2]]]]
+
+    # existing instances keep their order, and new ones go at the end
+    meta, data = channel.update({'c': 3, 'b': 2, 'd': 4})
+    assert meta['delta'] is True
+    assert meta['metrics'] == [{}, {'removed': ['a'], 'added': ['c', 'd']}]
+    assert data == [[100, [2, 3, 4]]]
+
+    meta, data = channel.update({'d': 4, 'b': 2})
+    assert meta['metrics'] == [{}, {'removed': ['c']}]
+    assert data == [[100, [2, 4]]]
+
+
+def test_full_meta():
+    # without delta-meta, every meta message lists all of the instances
+    channel = MockMetricsChannel()
+
+    meta, _data = channel.update({'a': 1, 'b': 2})
+    meta, data = channel.update({'c': 3, 'b': 2})
+    assert 'delta' not in meta
+    assert meta['metrics'][0]['name'] == 'memory.used'
+    assert meta['metrics'][1]['name'] == 'cgroup.memory.usage'
+    assert meta['metrics'][1]['instances'] == ['b', 'c']
+    assert data == [[100, [2, 3]]]
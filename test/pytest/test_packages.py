@@ -0,0 +1,457 @@
+# This file is part of Cockpit.
+#
+# Copyright (C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock
+import zipfile
+
+from pathlib import Path
+
+from cockpit.packages import (FileCache, Package, Packages, PackagesListener, ZipArchive, ZipPath,
+                              directory_items, parse_accept_language)
+
+
+class MockChannel:
+    origin = 'https://localhost:9090'
+
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+        self.out_headers = {}
+        self.status = None
+        self.body = None
+
+    def push_header(self, key, value):
+        self.out_headers[key] = value
+
+    def http_ok(self, content_type, extra_headers=None):
+        self.status = 200
+        self.out_headers.update({'Content-Type': content_type}, **(extra_headers or {}))
+
+    def http_not_modified(self, extra_headers=None):
+        self.status = 304
+        self.out_headers.update(extra_headers or {})
+
+    def http_error(self, status, message):
+        self.status = status
+        self.body = message.encode()
+
+    def send_body(self, data):
+        self.body = data
+
+
+class TestPackages(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.workdir.cleanup)
+
+        env = {
+            'XDG_DATA_HOME': f'{self.workdir.name}/home',
+            'XDG_DATA_DIRS': f'{self.workdir.name}/system',
+            'XDG_CACHE_HOME': f'{self.workdir.name}/cache',
+        }
+        patcher = unittest.mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.make_package('system', 'one', {'priority': 1}, {'index.html': b'<html>one</html>', 'sub/one.js': b'1'})
+        self.make_package('system', 'two', {}, {'two.js': b'2', 'two.css': b'body {}'})
+
+    def make_package(self, where, name, manifest, files):
+        path = f'{self.workdir.name}/{where}/cockpit/{name}'
+        os.makedirs(path, exist_ok=True)
+        with open(f'{path}/manifest.json', 'w') as file:
+            json.dump(manifest, file)
+        for filename, content in files.items():
+            os.makedirs(os.path.dirname(f'{path}/{filename}'), exist_ok=True)
+            with open(f'{path}/{filename}', 'wb') as file:
+                file.write(content)
+        return path
+
+    def test_basic(self):
+        packages = Packages()
+        assert set(packages.packages) == {'one', 'two'}
+        assert packages.checksum is not None
+
+    def test_user_content(self):
+        self.make_package('home', 'three', {}, {'three.js': b'3'})
+        packages = Packages()
+        assert set(packages.packages) == {'one', 'two', 'three'}
+        assert packages.checksum is None
+
+    def test_digest_cache(self):
+        cold = Packages().checksum
+        assert os.path.exists(f'{self.workdir.name}/cache/cockpit/package-digests.json')
+
+        # warm cache
+        assert Packages().checksum == cold
+
+        # modifying a file changes the checksum, with or without the cache
+        with open(f'{self.workdir.name}/system/cockpit/two/two.js', 'w') as file:
+            file.write('two')
+        modified = Packages().checksum
+        assert modified != cold
+
+        os.unlink(f'{self.workdir.name}/cache/cockpit/package-digests.json')
+        assert Packages().checksum == modified
+
+    def test_digest_cache_corrupt(self):
+        cold = Packages().checksum
+        for content in ['{', '[]', '{"x": 5}', '{"x": [1, 2, 3]}']:
+            with open(f'{self.workdir.name}/cache/cockpit/package-digests.json', 'w') as file:
+                file.write(content)
+            assert Packages().checksum == cold
+
+    def test_parallel_hashing(self):
+        for i in range(20):
+            self.make_package('system', f'many{i}', {}, {f'file{j}.js': os.urandom(100) for j in range(10)})
+
+        with unittest.mock.patch('os.cpu_count', return_value=1):
+            sequential = Packages().checksum
+
+        os.unlink(f'{self.workdir.name}/cache/cockpit/package-digests.json')
+        with unittest.mock.patch('os.cpu_count', return_value=4):
+            assert Packages().checksum == sequential
+
+    def test_lazy(self):
+        packages = Packages()
+        # neither the file index nor the checksum were computed yet
+        assert packages.checksum_pending is not None
+        assert all('files' not in vars(package) for package in packages.packages.values())
+        assert not os.path.exists(f'{self.workdir.name}/cache/cockpit/package-digests.json')
+        assert packages.get_bridges() == []
+
+        assert packages.checksum is not None
+        assert packages.checksum_pending is None
+        assert packages.packages['two'].files == {Path('two.js'), Path('two.css'), Path('manifest.json')}
+
+    def test_serve_file(self):
+        packages = Packages()
+
+        channel = MockChannel()
+        packages.serve_file('/two/two.js', channel)
+        assert channel.status == 200
+        assert channel.body == b'2'
+        assert channel.out_headers['X-Cockpit-Pkg-Checksum'] == packages.checksum
+
+        channel = MockChannel()
+        packages.serve_file('/one/index.html', channel)
+        assert channel.body == b'<html>one</html>'
+        assert 'Content-Security-Policy' in channel.out_headers
+
+        for missing in ['/two/nope.js', '/nope/two.js']:
+            channel = MockChannel()
+            packages.serve_file(missing, channel)
+            assert channel.status == 404
+
+    def test_file_cache(self):
+        cache = FileCache(max_size=10, max_item_size=5)
+        path = f'{self.workdir.name}/file'
+
+        def write(content):
+            with open(path, 'wb') as file:
+                file.write(content)
+
+        write(b'abc')
+        assert cache.read(path) == b'abc'
+        assert cache.size == 3
+
+        # changes are noticed
+        write(b'abcd')
+        assert cache.read(path) == b'abcd'
+        assert cache.size == 7
+
+        # too big to cache
+        write(b'abcdef')
+        assert cache.read(path) == b'abcdef'
+        assert cache.size == 7
+
+        # least recently used entries are evicted
+        write(b'xyzzy')
+        assert cache.read(path) == b'xyzzy'
+        assert cache.size == 9
+        assert len(cache.entries) == 2
+
+    def test_file_cache_compress(self):
+        data = b'console.log("hello");\n' * 1000
+        cache = FileCache(max_size=len(data), max_item_size=100)
+
+        # bigger than an item can be, but compressed only once
+        compressed = cache.compress('digest', data)
+        assert len(compressed) > 100
+        assert cache.compress('digest', data) is compressed
+        assert gzip.decompress(compressed) == data
+
+    def test_conditional(self):
+        # With a checksum, cockpit-ws does the validation
+        packages = Packages()
+        channel = MockChannel()
+        packages.serve_file('/two/two.js', channel)
+        assert channel.status == 200
+        assert 'ETag' not in channel.out_headers
+        assert 'Last-Modified' not in channel.out_headers
+        # ... so there's no need to hash the file
+        assert packages.file_cache.digests == {}
+
+        # Without one (because of user content), we do it
+        self.make_package('home', 'three', {}, {'three.js': b'3'})
+        packages = Packages()
+        assert packages.checksum is None
+
+        channel = MockChannel()
+        packages.serve_file('/two/two.js', channel)
+        assert channel.status == 200
+        etag = channel.out_headers['ETag']
+        last_modified = channel.out_headers['Last-Modified']
+
+        for headers in [{'If-None-Match': etag},
+                        {'If-None-Match': f'"nope", W/{etag}'},
+                        {'If-None-Match': '*'},
+                        {'If-Modified-Since': last_modified}]:
+            channel = MockChannel(headers)
+            packages.serve_file('/two/two.js', channel)
+            assert channel.status == 304
+            assert channel.out_headers['ETag'] == etag
+            assert channel.body is None
+
+        # If-None-Match takes precedence
+        for headers in [{'If-None-Match': '"nope"'},
+                        {'If-None-Match': '"nope"', 'If-Modified-Since': last_modified},
+                        {'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'},
+                        {'If-Modified-Since': 'garbage'}]:
+            channel = MockChannel(headers)
+            packages.serve_file('/two/two.js', channel)
+            assert channel.status == 200
+            assert channel.body == b'2'
+
+        # the ETag follows the content
+        with open(f'{self.workdir.name}/system/cockpit/two/two.js', 'w') as file:
+            file.write('two')
+        channel = MockChannel({'If-None-Match': etag})
+        packages.serve_file('/two/two.js', channel)
+        assert channel.status == 200
+        assert channel.out_headers['ETag'] != etag
+        assert channel.body == b'two'
+
+        # different files have different tags
+        channel = MockChannel({'If-None-Match': etag})
+        packages.serve_file('/two/two.css', channel)
+        assert channel.status == 200
+
+    def test_accept_language(self):
+        assert parse_accept_language('') is None
+        assert parse_accept_language('de') == 'de'
+        assert parse_accept_language('de-DE') == 'de_DE'
+        assert parse_accept_language('pt-br,de;q=0.8') == 'pt_BR'
+        assert parse_accept_language('en;q=0.5, de-de;q=0.9, *;q=1') == 'de_DE'
+        assert parse_accept_language('en;q=0.9, de;q=0.9') == 'en'
+        assert parse_accept_language('en;q=0, de;q=bogus') is None
+
+    def test_negotiation(self):
+        self.make_package('system', 'lang', {}, {
+            'po.js': b'en', 'po.de.js': b'de', 'po.pt_BR.js': b'pt_BR',
+            'app.min.js': b'min', 'style.css.gz': b'gz', 'sub/page.html': b'page',
+        })
+        packages = Packages()
+
+        def get(path, language=None):
+            channel = MockChannel({'Accept-Language': language} if language else {})
+            packages.serve_file(path, channel)
+            return channel.body, channel.out_headers.get('Content-Encoding')
+
+        assert get('/lang/po.js') == (b'en', None)
+        assert get('/lang/po.js', 'de-DE,en;q=0.5') == (b'de', None)
+        assert get('/lang/po.js', 'de;q=0.5,pt-BR') == (b'pt_BR', None)
+        assert get('/lang/po.js', 'pt') == (b'en', None)
+        assert get('/lang/po.js', 'fr,de;q=0.9') == (b'en', None)
+        assert get('/lang/app.js') == (b'min', None)
+        assert get('/lang/app.extra.js') == (b'min', None)
+        assert get('/lang/style.css') == (b'gz', 'gzip')
+        assert get('/lang/sub/page.html') == (b'page', None)
+        assert get('/lang/nope.js') == (b'Not found', None)
+
+        # results are remembered, per locale
+        package = packages.packages['lang']
+        assert package.negotiated['po.js', 'de_DE'][0] == 'po.de.js'
+        assert package.negotiated['nope.js', None] is None
+
+    def test_cached_responses(self):
+        packages = Packages()
+
+        channel = MockChannel()
+        packages.serve_file('/manifests.js', channel)
+        assert b'"priority": 1' in channel.body
+        body = channel.body
+        packages.serve_file('/manifests.js', channel)
+        assert channel.body is body
+
+        package = packages.packages['one']
+        policy = package.get_content_security_policy('https://localhost:9090')
+        assert package.get_content_security_policy('https://localhost:9090') is policy
+        assert 'wss://localhost:9090' in policy
+        assert 'wss://other' in package.get_content_security_policy('https://other')
+
+        # reloading picks up changes
+        self.make_package('system', 'three', {'menu': {}}, {'three.js': b'3'})
+        packages.load_packages()
+        packages.serve_file('/manifests.js', channel)
+        assert b'"three": {"menu": {}}' in channel.body
+
+    def test_reload(self):
+        packages = Packages()
+        checksum = packages.checksum
+        one = packages.packages['one']
+        two = packages.packages['two']
+
+        self.make_package('system', 'three', {}, {'three.js': b'3'})
+        with open(f'{self.workdir.name}/system/cockpit/two/two.js', 'w') as file:
+            file.write('two')
+        packages.reload({Path(f'{self.workdir.name}/system/cockpit/three'),
+                         Path(f'{self.workdir.name}/system/cockpit/two')})
+
+        # only the changed packages got rebuilt
+        assert set(packages.packages) == {'one', 'two', 'three'}
+        assert packages.packages['one'] is one
+        assert packages.packages['two'] is not two
+
+        # and the checksum is the same as from scratch
+        assert packages.checksum != checksum
+        assert packages.checksum == Packages().checksum
+
+        channel = MockChannel()
+        packages.serve_file('/two/two.js', channel)
+        assert channel.body == b'two'
+
+        # removing a package
+        os.unlink(f'{self.workdir.name}/system/cockpit/three/manifest.json')
+        packages.reload()
+        assert set(packages.packages) == {'one', 'two'}
+        assert packages.checksum == Packages().checksum
+
+    def test_invalid_manifest(self):
+        path = self.make_package('system', 'broken', {}, {})
+        with open(f'{path}/manifest.json', 'w') as file:
+            file.write('{')
+        with self.assertLogs('cockpit.packages', 'WARNING'):
+            packages = Packages()
+        assert set(packages.packages) == {'one', 'two'}
+
+    def test_reload_delay(self):
+        packages = Packages()
+        changed = []
+
+        class Listener(PackagesListener):
+            def packages_loaded(self):
+                changed.append(set(packages.packages))
+
+        async def burst():
+            packages.listener = Listener()
+            self.make_package('system', 'three', {}, {'three.js': b'3'})
+            packages.path_changed(Path(f'{self.workdir.name}/system/cockpit/three'))
+            packages.path_changed(Path(f'{self.workdir.name}/system/cockpit/three/three.js'))
+            await asyncio.sleep(packages.RELOAD_DELAY / 2)
+            assert changed == []
+            await asyncio.sleep(packages.RELOAD_DELAY * 2)
+
+        # watching requires systemd_ctypes, so don't start any watches
+        with unittest.mock.patch.object(packages, 'update_watches'):
+            asyncio.run(burst())
+        assert changed == [{'one', 'two', 'three'}]
+
+    def test_zip(self):
+        filename = f'{self.workdir.name}/bridge.pyz'
+        with open(filename, 'wb') as file:
+            file.write(b'#!/usr/bin/python3\n')
+        with zipfile.ZipFile(filename, 'a') as archive:
+            for path in Path(f'{self.workdir.name}/system/cockpit').rglob('*'):
+                if path.is_file():
+                    name = f'dist/{path.relative_to(self.workdir.name + "/system/cockpit")}'
+                    compression = zipfile.ZIP_STORED if path.suffix == '.js' else zipfile.ZIP_DEFLATED
+                    archive.write(path, name, compress_type=compression)
+
+        archive = ZipArchive(filename)
+        root = ZipPath(archive, 'dist')
+        assert [item.name for item in directory_items(root)] == ['one', 'two']
+        assert (root / 'one' / 'sub').is_dir()
+        assert (root / 'one' / 'sub' / 'one.js').is_file()
+        assert archive.read('dist/one/sub/one.js') == b'1'
+        assert archive.read('dist/one/index.html') == b'<html>one</html>'
+        with self.assertRaises(FileNotFoundError):
+            archive.read('dist/nope')
+
+        # compressed members get cached, stored ones are mapped
+        assert 'dist/one/index.html' in archive.cache
+        assert 'dist/one/sub/one.js' not in archive.cache
+
+        packages = Packages()
+        for name in ['one', 'two']:
+            package = Package(root / name)
+            on_disk = packages.packages[name]
+            assert package.files == on_disk.files
+
+            packages.update_checksum_data([package, on_disk])
+            assert package.checksum_data == on_disk.checksum_data
+
+        channel = MockChannel()
+        package.serve_file('two.css', channel, packages.file_cache)
+        assert channel.status == 200
+        assert channel.body == b'body {}'
+
+    def test_compression(self):
+        script = b'console.log("hello");\n' * 100
+        # user content, so that there's no checksum and we send ETags
+        self.make_package('home', 'big', {}, {'big.js': script, 'big.png': script, 'small.css': b'body {}'})
+        packages = Packages()
+
+        def get(path, accept_encoding=None, if_none_match=None):
+            headers = {}
+            if accept_encoding is not None:
+                headers['Accept-Encoding'] = accept_encoding
+            if if_none_match is not None:
+                headers['If-None-Match'] = if_none_match
+            channel = MockChannel(headers)
+            packages.serve_file(path, channel)
+            return channel
+
+        channel = get('/big/big.js', 'gzip, deflate')
+        assert channel.out_headers['Content-Encoding'] == 'gzip'
+        assert channel.out_headers['Vary'] == 'Accept-Encoding'
+        assert gzip.decompress(channel.body) == script
+        assert len(channel.body) < len(script)
+        etag = channel.out_headers['ETag']
+
+        # compressed only once
+        assert get('/big/big.js', 'gzip').body is channel.body
+
+        # the representations have different tags
+        channel = get('/big/big.js')
+        assert channel.out_headers.get('Content-Encoding') is None
+        assert channel.out_headers['ETag'] != etag
+        assert channel.body == script
+        assert get('/big/big.js', 'gzip', if_none_match=etag).status == 304
+        assert get('/big/big.js', if_none_match=etag).status == 200
+
+        for accept_encoding in ['identity', 'gzip;q=0', 'br']:
+            assert get('/big/big.js', accept_encoding).body == script
+
+        # not text, or too small
+        assert get('/big/big.png', 'gzip').body == script
+        assert get('/big/small.css', 'gzip').body == b'body {}'
@@ -19,6 +19,7 @@ import collections
 import multiprocessing
 import numbers
 import os
+import tempfile
 import unittest
 
 import pytest
@@ -47,8 +48,9 @@ class TestSamples(unittest.TestCase):
 
     def test_descriptions(self):
         for cls in cockpit.samples.SAMPLERS:
-            # currently broken in containers with no cgroups or temperatures present
-            if cls in [cockpit.samples.CGroupSampler, cockpit.samples.CPUTemperatureSampler]:
+            # currently broken in containers with no cgroups, temperatures or PSI present
+            if cls in [cockpit.samples.CGroupSampler, cockpit.samples.CPUTemperatureSampler,
+                       cockpit.samples.PressureSampler]:
                 continue
 
             self.get_checked_samples(cls())
@@ -59,6 +61,69 @@ class TestSamples(unittest.TestCase):
 
         self.get_checked_samples(cockpit.samples.CGroupSampler())
 
+    def test_pressure_descriptions(self):
+        if not os.path.exists('/proc/pressure/io'):
+            pytest.xfail('No PSI present')
+
+        self.get_checked_samples(cockpit.samples.PressureSampler())
+
+    def test_pressure_parse(self):
+        psi = (b'some avg10=0.00 avg60=0.00 avg300=0.00 total=1234567\n'
+               b'full avg10=0.00 avg60=0.00 avg300=0.00 total=89\n')
+        assert cockpit.samples.parse_pressure_total(psi, b'some') == 1234.567
+        assert cockpit.samples.parse_pressure_total(psi, b'full') == 0.089
+        assert cockpit.samples.parse_pressure_total(psi[:55], b'full') is None
+        assert cockpit.samples.parse_pressure_total(None, b'some') is None
+
+        io_stat = (b'8:0 rbytes=90112 wbytes=4096 rios=3 wios=1 dbytes=0 dios=0\n'
+                   b'253:0 rbytes=10 wbytes=20 rios=1 wios=1 dbytes=0 dios=0\n')
+        assert cockpit.samples.sum_io_stat(io_stat, b' rbytes=') == 90122
+        assert cockpit.samples.sum_io_stat(io_stat, b' wbytes=') == 4116
+        assert cockpit.samples.sum_io_stat(b'', b' rbytes=') == 0
+        # a partial read can end in the middle of a field
+        assert cockpit.samples.sum_io_stat(io_stat[:io_stat.rindex(b'wbytes=') + 7], b' wbytes=') == 4096
+        assert cockpit.samples.sum_io_stat(b'8:0 rbytes=', b' rbytes=') == 0
+        assert cockpit.samples.parse_pressure_total(psi[:45], b'some') is None
+
+    def test_cgroup_missing_stats(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # no pressure files, and an io.stat that's bigger than a page
+            os.mkdir(f'{tmpdir}/user.slice')
+            with open(f'{tmpdir}/user.slice/cpu.stat', 'w') as file:
+                file.write('usage_usec 5000\n')
+            with open(f'{tmpdir}/user.slice/io.stat', 'w') as file:
+                for minor in range(100):
+                    file.write(f'8:{minor} rbytes=1000 wbytes=10 rios=1 wios=1 dbytes=0 dios=0\n')
+
+            sampler = cockpit.samples.CGroupSampler()
+            sampler.cgroups_v2 = True
+            sampler.cgroups_v2_path = f'{tmpdir}/'
+            samples: cockpit.samples.Samples = collections.defaultdict(dict)
+            sampler.sample(samples)
+
+        assert samples['cgroup.cpu.usage'] == {'user.slice': 5}
+        assert samples['cgroup.io.read'] == {'user.slice': 100000}
+        assert samples['cgroup.io.written'] == {'user.slice': 1000}
+        # counters that we couldn't read are left out, not None
+        for resource in ['cpu.pressure.some', 'memory.pressure.some', 'io.pressure.full']:
+            assert samples[f'cgroup.{resource}'] == {}
+
+    def test_network(self):
+        proc = self.get_checked_samples(cockpit.samples.NetworkSampler())
+        netlink_sampler = cockpit.samples.NetlinkNetworkSampler()
+        if netlink_sampler.sock is None:
+            pytest.xfail('No netlink available')
+        netlink = self.get_checked_samples(netlink_sampler)
+
+        # both implementations should see the same interfaces
+        for descr in cockpit.samples.NetworkSampler.descriptions:
+            assert set(proc[descr.name]) == set(netlink[descr.name])
+        assert 'lo' in netlink['network.interface.rx']
+
+        # ...and the counters can only go up
+        for iface, value in proc['network.interface.rx'].items():
+            assert netlink['network.interface.rx'][iface] >= value
+
     def test_temperature_descriptions(self):
         samples = collections.defaultdict(dict)
         cockpit.samples.CPUTemperatureSampler().sample(samples)
@@ -81,3 +146,19 @@ class TestSamples(unittest.TestCase):
         for name, temperature in samples['cpu.temperature'].items():
             assert name.startswith('/sys/')
             assert 0 < temperature < 200  # !!
+
+    def test_process(self):
+        sampler = cockpit.samples.ProcessSampler()
+        sampler.top = 100000
+        samples = self.get_checked_samples(sampler)
+
+        instance = f'{os.getpid()}:'
+        mine = [name for name in samples['process.rss'] if name.startswith(instance)]
+        assert len(mine) == 1
+        assert samples['process.rss'][mine[0]] > 0
+        assert samples['process.threads'][mine[0]] >= 1
+
+        # the top-N cut is applied on subsequent samples too
+        sampler.top = 1
+        samples = self.get_checked_samples(sampler)
+        assert len(samples['process.cpu']) == 1